@@ -0,0 +1,375 @@
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# Runs without display, must be set before Qt is loaded
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtWidgets import QApplication
+
+import main
+from main import DetectionScheduler, DetectionWorker, ImageProcessor, StripComposer
+
+SESSION_SIZES = (3, 6, 10)
+FACES = 2
+STREAM_FRAMES = 30
+FOOTPRINT_IDLE = 2
+# Seconds waiting for trigger before session, on footprint runs
+
+class FakeVideoCapture():
+    def __init__(self, *args, frames=None, width=840, height=680, fps=30):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.index = 0
+
+        if frames is None:
+            rng = np.random.default_rng(0)
+            frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+        self.frames = frames
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+        # Synthetic frames do not change with camera properties
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+    def read(self):
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+
+        return True, frame.copy()
+
+    def grab(self):
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        return True, self.frames[self.index % len(self.frames)].copy()
+
+    def release(self):
+        pass
+
+class PacedVideoCapture(FakeVideoCapture):
+    def grab(self):
+        time.sleep(1 / self.fps)
+        return super().grab()
+
+    def read(self):
+        time.sleep(1 / self.fps)
+        return super().read()
+        # Blocks like a real camera, so idle loops do not spin
+
+def load_frames(directory, width, height):
+    frames = list()
+
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith(main.IMAGE_EXTENSIONS):
+            frame = cv2.imread(f"{directory}/{filename}")
+            if frame is not None:
+                frames.append(cv2.resize(frame, (width, height)))
+
+    return frames
+
+def legacy_compose(imageProcessor, frames, faces, stamp=None):
+    images = [Image.fromarray(frame) for frame in frames]
+    width, height = images[0].size
+
+    if stamp is not None:
+        images.insert(0, Image.fromarray(stamp))
+
+    total_width = width * len(images) + imageProcessor.border_size * len(images)
+    max_height = height + imageProcessor.border_size * 2
+
+    new_im_x = imageProcessor.append_horizontally(images, width, total_width, max_height)
+    new_im_y = imageProcessor.append_vertically(new_im_x, total_width, max_height, faces)
+
+    return np.asarray(new_im_y)
+
+def legacy_filter(filter_image, frame):
+    image = Image.fromarray(frame)
+    image.paste(filter_image, (0, 0), filter_image.getchannel("A"))
+
+    return np.asarray(image)
+
+def measure(fn, repeat):
+    fn()
+    # Warm up, first call may load models or fill caches
+
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "runs": repeat,
+        "min_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "mean_ms": statistics.mean(times) * 1000,
+    }
+
+def bench_capture(frames, repeat):
+    main.cv2.VideoCapture = lambda *args: FakeVideoCapture(frames=frames)
+    # Stand-in for camera, QtCapture opens it on constructor
+
+    capture = main.QtCapture()
+    capture.show()
+    QApplication.processEvents()
+    # Widgets are painted only once shown
+
+    def next_frame():
+        with capture.grabber.lock:
+            capture.grabber.frame = frames[capture.grabber.frame_id % len(frames)]
+            capture.grabber.frame_id += 1
+        # Grabber thread is not started, frames are delivered synchronously
+
+        capture.nextFrameSlot()
+        capture.video_frame.repaint()
+
+    results = {
+        "next_frame_slot": measure(next_frame, repeat),
+        "get_people_on_image": measure(lambda: capture.getPeopleOnImage(frames[0]), repeat),
+    }
+
+    capture.stop()
+    capture.deleteLater()
+
+    return results
+
+def bench_detection(frames, repeat, interval, scale):
+    detector = DetectionWorker()
+    stream = [frames[index % len(frames)] for index in range(STREAM_FRAMES)]
+
+    every_frame = DetectionScheduler(detector.detect)
+    scheduled = DetectionScheduler(detector.detect, interval, scale)
+
+    results = {
+        "detection_every_frame": measure(lambda: [every_frame.process(frame) for frame in stream], repeat),
+        "detection_scheduled": measure(lambda: [scheduled.process(frame) for frame in stream], repeat),
+    }
+    # Both over same stream of frames, as live preview would send them
+
+    for name, scheduler in (("every frame", every_frame), ("scheduled", scheduled)):
+        stats = scheduler.stats()
+        print(f"Detection {name}: {stats['detections']}/{stats['frames']} frames detected, {stats['cpu_ms_per_frame']:.2f} CPU ms per frame")
+
+    return results
+
+def bench_processing(frames, workdir, repeat):
+    imageProcessor = ImageProcessor()
+    composer = StripComposer(imageProcessor.border_size)
+
+    height, width = frames[0].shape[:2]
+    rng = np.random.default_rng(0)
+
+    filter_image = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    imageProcessor.filter_filepath = f"{workdir}/filter.png"
+    Image.fromarray(filter_image, "RGBA").save(imageProcessor.filter_filepath)
+
+    stamp = rng.integers(0, 256, (height, width // 2, 3), dtype=np.uint8)
+    rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+
+    filter_pil = Image.fromarray(filter_image, "RGBA")
+    overlay = main.OVERLAY_CACHE.alpha(imageProcessor.filter_filepath, (width, height))
+    assert np.array_equal(legacy_filter(filter_pil, rgb_frames[0]), overlay.apply(rgb_frames[0])), "Filter blending differs"
+
+    results = {
+        "apply_filter": measure(lambda: imageProcessor.apply_filter(Image.fromarray(rgb_frames[0])), repeat),
+        "filter_pil_paste": measure(lambda: legacy_filter(filter_pil, rgb_frames[0]), repeat),
+        "filter_blend": measure(lambda: overlay.apply(rgb_frames[0]), repeat),
+    }
+
+    for images in SESSION_SIZES:
+        session = [rgb_frames[index % len(rgb_frames)] for index in range(images)]
+
+        legacy = legacy_compose(imageProcessor, session, FACES, stamp)
+        vectorized = composer.compose(session, FACES, stamp)
+        assert np.array_equal(legacy, vectorized), "Composers output differs"
+
+        results[f"append_pil_{images}"] = measure(lambda: legacy_compose(imageProcessor, session, FACES, stamp), repeat)
+        results[f"compose_numpy_{images}"] = measure(lambda: composer.compose(session, FACES, stamp), repeat)
+
+    strip = composer.compose(rgb_frames[:main.IMAGES_PER_SESSION], FACES, stamp)
+    results["png_save"] = measure(lambda: Image.fromarray(strip).save(f"{workdir}/strip.png"), repeat)
+
+    return results
+
+def peak_memory_mb():
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak RSS of getrusage survives exec, so it may belong to parent process
+
+    return main.peak_rss_mb()
+
+def footprint_qt(frames):
+    app = QApplication(sys.argv)
+
+    capture = main.QtSaveContentCapture()
+    capture.engine.time_limit = 1
+    sessions = list()
+    capture.engine.subscribe(lambda event, value: sessions.append(value) if event == "session" else None)
+
+    capture.show()
+    capture.start()
+
+    start = time.monotonic()
+    triggered = False
+    while not sessions or not sessions[0].done():
+        if not triggered and time.monotonic() - start > FOOTPRINT_IDLE:
+            capture.keyPressEvent(QtGui.QKeyEvent(QtCore.QEvent.KeyPress, QtCore.Qt.Key_Space, QtCore.Qt.NoModifier))
+            triggered = True
+        app.processEvents()
+        time.sleep(0.001)
+
+    capture.stop()
+    capture.deleteLater()
+
+def footprint_headless(frames):
+    kiosk = main.HeadlessKiosk(0)
+    kiosk.engine.time_limit = 1
+    sessions = list()
+    kiosk.engine.subscribe(lambda event, value: sessions.append(value) if event == "session" else None)
+
+    def drive():
+        time.sleep(FOOTPRINT_IDLE)
+        kiosk.command("trigger")
+
+        while not sessions or not sessions[0].done():
+            time.sleep(0.01)
+        kiosk.command("quit")
+
+    threading.Thread(target=drive, daemon=True).start()
+    kiosk.run()
+
+def footprint_child(mode, frames):
+    with tempfile.TemporaryDirectory() as workdir:
+        main.DIRECTORY = workdir
+        main.MAIN_FOLDER = f"{workdir}/images"
+        main.SESSIONS_FOLDER = f"{workdir}/sessions"
+        main.CONFIG_FILEPATH = f"{workdir}/{main.CONFIG_FILENAME}"
+        main.cv2.VideoCapture = lambda *args: PacedVideoCapture(frames=frames)
+
+        start = time.monotonic()
+        cpu_start = time.process_time()
+
+        if mode == "qt":
+            footprint_qt(frames)
+        else:
+            footprint_headless(frames)
+
+        report = {
+            "mode": mode,
+            "wall_s": time.monotonic() - start,
+            "cpu_s": time.process_time() - cpu_start,
+            "peak_rss_mb": peak_memory_mb(),
+        }
+
+    print(json.dumps(report))
+    # Last line is read by parent process
+
+def bench_footprint(args):
+    results = dict()
+
+    for mode in ("qt", "headless"):
+        command = [sys.executable, __file__, "--footprint-child", mode, "--width", str(args.width), "--height", str(args.height)]
+        if args.frames:
+            command += ["--frames", args.frames]
+
+        output = subprocess.run(command, capture_output=True, text=True, stdin=subprocess.DEVNULL, check=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        # Separate processes, so peak memory of one does not hide the other
+
+        print(f"Footprint {mode:<9} CPU {report['cpu_s']:6.2f}s over {report['wall_s']:5.2f}s, peak RSS {report['peak_rss_mb'] or 0:.1f} MB")
+        results[f"footprint_{mode}"] = report
+
+    return results
+
+def print_results(results):
+    for stage, result in results.items():
+        print(f"{stage:<24} min {result['min_ms']:9.2f} ms   median {result['median_ms']:9.2f} ms")
+
+def main_benchmark():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--width", type=int, default=840, help="Frames width")
+    ap.add_argument("--height", type=int, default=680, help="Frames height")
+    ap.add_argument("--frames", required=False, help="Folder of recorded frames, synthetic ones are used otherwise")
+    ap.add_argument("--detection-interval", type=int, default=5, help="Frames between full detections")
+    ap.add_argument("--detection-scale", type=float, default=0.5, help="Downscale factor for detection")
+    ap.add_argument("-r", "--repeat", type=int, default=10, help="Runs per measure")
+    ap.add_argument("-o", "--output", required=False, help="Writes results as JSON")
+    ap.add_argument("--footprint", action="store_true", help="Compares CPU and memory of Qt and headless sessions")
+    ap.add_argument("--footprint-child", choices=("qt", "headless"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.frames:
+        frames = load_frames(args.frames, args.width, args.height)
+    else:
+        frames = FakeVideoCapture(width=args.width, height=args.height).frames
+
+    if args.footprint_child:
+        footprint_child(args.footprint_child, frames)
+        return
+        # One idle period and one session, run by --footprint
+
+    app = QApplication(sys.argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        main.DIRECTORY = workdir
+        main.MAIN_FOLDER = f"{workdir}/images"
+        main.CONFIG_FILEPATH = f"{workdir}/{main.CONFIG_FILENAME}"
+        # Keeps user config and images untouched
+
+        results = dict()
+        results.update(bench_capture(frames, args.repeat))
+        results.update(bench_detection(frames, args.repeat, args.detection_interval, args.detection_scale))
+        results.update(bench_processing(frames, workdir, args.repeat))
+
+    print_results(results)
+
+    footprint = bench_footprint(args) if args.footprint else dict()
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "width": args.width,
+            "height": args.height,
+            "frames": args.frames or "synthetic",
+            "stages": results,
+            "footprint": footprint,
+        }
+
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+if __name__ == "__main__":
+    main_benchmark()
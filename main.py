@@ -1,8 +1,26 @@
+import time
+STARTED_AT = time.perf_counter()
+# Startup report counts from here
+
 import cv2
+import numpy as np
 import os, sys
 import argparse
-import mediapipe as mp
-import math, copy
+import threading, queue, json, glob, hashlib
+import concurrent.futures
+import subprocess
+import sqlite3
+import socketserver
+import contextlib
+import multiprocessing
+
+from collections import OrderedDict, deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+    # Not available on Windows, peak memory is not reported there
 
 from PIL import Image
 from PyQt5.Qt import Qt
@@ -14,24 +32,84 @@ from PyQt5.QtWidgets import (
                                 QLabel, QApplication,
                                 QMessageBox, QLineEdit,
                                 QSizePolicy, QVBoxLayout,
-                                QGridLayout, QFileDialog
+                                QGridLayout, QFileDialog,
+                                QComboBox, QCheckBox,
+                                QListView
                             )
 from PyQt5.QtGui import QPixmap
 
+mp = None
+mediapipe_lock = threading.Lock()
+# MediaPipe takes most of import time, loaded on first use or on warm-up
+
 IMAGES_PER_SESSION = 3
 DIRECTORY = f"{os.path.expanduser('~')}/photo-cabinet"
 MAIN_FOLDER = f"{DIRECTORY}/images"
+SESSIONS_FOLDER = f"{DIRECTORY}/sessions"
+# Raw frames of each session, to render strips again
+FRAME_SOURCE = None
+FREE_RUN = False
+# Replay source set from arguments, camera from config is used otherwise
+SESSION_FACES_FILENAME = "faces.csv"
+METRICS_FILENAME = "metrics.json"
+INDEX_FILENAME = "index.sqlite"
+THUMBNAILS_FOLDERNAME = "thumbnails"
+THUMBNAIL_SIZE = 240
+GALLERY_PAGE_SIZE = 200
+METRICS_INTERVAL = 5
+# Seconds between metrics exports
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+FRESH_FRAME_FRACTION = 0.5
+# Grabs slower than this share of camera interval waited for a new frame
+MAX_DRAINED_FRAMES = 4
+MAX_CAMERAS = 4
+PACER_HIGH_LOAD = 0.8
+PACER_LOW_LOAD = 0.4
+PACER_MAX_SLOWDOWN = 4.0
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp")
+}
+# Format name for PIL and file extension
+OUTPUT_QUALITIES = range(1, 101)
+PNG_COMPRESS_LEVELS = range(10)
+# Values PIL encoders accept, others fail every save
 CONFIG_FILENAME = ".config"
 CONFIG_FILEPATH = f"{DIRECTORY}/{CONFIG_FILENAME}"
+CALIBRATION_MIN_CONFIDENCE = 0.1
+# Detections below it are never considered as faces
+CALIBRATION_FRAMES = 30
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+CAMERAS_FILENAME = "cameras.json"
+PROBE_RESOLUTIONS = ((640, 480), (840, 680), (1280, 720), (1920, 1080))
+PROBE_TIMEOUT = 10
+# Seconds to wait for all cameras to answer
+PROBE_FRAMES = 5
+# Frames timed on each resolution to measure real delivery rate
+SUSTAINED_FPS_FRACTION = 0.9
+# Probed rate a resolution needs, as share of configured one, to be streamed
+DEFAULT_STILL_RESOLUTION = (1280, 720)
+# Used when no probed resolution sustains rate, larger ones are set on config
+WARMUP_TIMEOUT = 3
+# Seconds a window waits for warm-up before opening cold
 
 # TODO: Divide file in multiple files.
 
 class ConfigManager():
-    def __init__(self):
+    def __init__(self, filepath=None):
+        self.filepath = filepath or CONFIG_FILEPATH
         self.config_dict = dict()
+        self.mtime = None
+        # Modification time of last parsed or saved file
+
+        self.lock = threading.RLock()
+        self.listeners = list()
 
-        if not os.path.exists(DIRECTORY):
-            os.mkdir(DIRECTORY)
+        directory = os.path.dirname(self.filepath)
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
             self.create_config_file()
         else:
             try:
@@ -44,157 +122,2563 @@ class ConfigManager():
         self.config_dict = {
             "face_detection_coeff": "0.8",
             "camera_index": "0",
-            "images_session": "3",
-            "config": CONFIG_FILEPATH,
+            "images_session": str(IMAGES_PER_SESSION),
+            "detection_interval": "5",
+            "detection_scale": "0.5",
+            "burst_frames": "5",
+            "detection_workers": "2",
+            "preview_width": "640",
+            "still_width": "0",
+            "still_height": "0",
+            "output_format": "png",
+            "output_quality": "90",
+            "png_compress_level": "6",
+            "output_progressive": "0",
+            "web_copy_width": "0",
+            "metrics_enabled": "0",
+            "config": self.filepath,
             "main_folder": MAIN_FOLDER,
             "stamp_filepath": "",
-            "filter_filepath": ""
+            "filter_filepath": "",
+            "live_filter": "1"
         }
 
-        self.save()
+        self.save()
+
+    def parse_config_file(self):
+        with self.lock:
+            mtime = os.path.getmtime(self.filepath)
+
+            with open(self.filepath, "r") as file:
+                file_content = file.read()
+
+            config_dict = dict()
+            lines = file_content.split("\n")
+            for line in lines:
+                param, value = line.split(",", 1)
+                config_dict[param] = value
+                # Only first comma splits, paths can include them
+
+            self.config_dict = config_dict
+            self.mtime = mtime
+
+    def reload(self):
+        try:
+            if os.path.getmtime(self.filepath) == self.mtime:
+                return False
+
+            self.parse_config_file()
+        except (OSError, ValueError):
+            return False
+            # Keeps last values while file is missing or being written
+
+        self.notify()
+        return True
+
+    def subscribe(self, callback):
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def notify(self):
+        config_dict = self.get_all()
+
+        for callback in list(self.listeners):
+            callback(config_dict)
+        # Called on thread which saved or reloaded config
+
+    def set(self, param, value):
+        with self.lock:
+            self.config_dict[param] = value
+
+    def get(self, param):
+        self.reload()
+
+        with self.lock:
+            if param in self.config_dict.keys():
+                value = self.config_dict[param]
+            else:
+                value = 0
+                # Its useful to set 0 to default values
+
+        return value
+
+    def get_float(self, param, default=0.0):
+        try:
+            return float(self.get(param) or default)
+        except ValueError:
+            return default
+
+    def get_int(self, param, default=0):
+        try:
+            return int(self.get(param) or default)
+        except ValueError:
+            return default
+
+    def get_all(self):
+        self.reload()
+
+        with self.lock:
+            return dict(self.config_dict)
+            # Copy, so editing it does not change config until saved
+
+    def save(self, config_dict=None):
+        with self.lock:
+            if config_dict:
+                self.config_dict = dict(config_dict)
+
+            self.write_config_file()
+
+        self.notify()
+
+    def write_config_file(self):
+        with self.lock:
+            file_content = ""
+            for key, value in self.config_dict.items():
+                file_content += f"{key},{value}\n"
+
+            file_content = file_content[:-1]
+            # Deletes last \n to not generate other item on parsing
+
+            temp_filepath = f"{self.filepath}.tmp"
+            with open(temp_filepath, "w") as file:
+                file.write(file_content)
+            os.replace(temp_filepath, self.filepath)
+            # Readers never see a partially written file
+
+            self.mtime = os.path.getmtime(self.filepath)
+
+    def update(self, changes):
+        with self.lock:
+            try:
+                self.parse_config_file()
+            except (OSError, ValueError):
+                pass
+                # Merges into last values while file is missing or being written
+
+            self.config_dict.update(changes)
+            self.write_config_file()
+
+        self.notify()
+
+config_manager = None
+
+def get_config():
+    global config_manager
+
+    if config_manager is None or config_manager.filepath != CONFIG_FILEPATH:
+        config_manager = ConfigManager()
+        # Created again only if config file is changed by arguments
+
+    return config_manager
+
+class StageTimer():
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+
+class StageMetrics():
+    def __init__(self, window=300):
+        self.enabled = False
+        self.window = window
+        # Samples kept per stage
+
+        self.lock = threading.Lock()
+        self.samples = dict()
+        self.counters = dict()
+
+        self.disabled_timer = contextlib.nullcontext()
+        # Shared, so disabled metrics cost a single check
+        self.exporter = None
+
+    def timer(self, stage):
+        if not self.enabled:
+            return self.disabled_timer
+
+        return StageTimer(self, stage)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+            self.samples[stage].append((time.monotonic(), seconds))
+
+    def count(self, counter, value=1):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def rate(self, stage):
+        with self.lock:
+            samples = list(self.samples.get(stage, ()))
+
+        if len(samples) < 2 or samples[-1][0] == samples[0][0]:
+            return 0.0
+
+        return (len(samples) - 1) / (samples[-1][0] - samples[0][0])
+        # Events per second over rolling window
+
+    def mean_ms(self, stage):
+        with self.lock:
+            samples = [seconds for _, seconds in self.samples.get(stage, ())]
+
+        return sum(samples) * 1000 / len(samples) if samples else 0.0
+
+    def summary(self):
+        with self.lock:
+            stages = {stage: [seconds * 1000 for _, seconds in samples] for stage, samples in self.samples.items()}
+            counters = dict(self.counters)
+
+        summary = {"timestamp": time.time(), "counters": counters, "stages": dict()}
+
+        for stage, samples in stages.items():
+            if not samples:
+                continue
+
+            samples_array = np.array(samples)
+            histogram = np.histogram(samples_array, bins=(0, *HISTOGRAM_BUCKETS_MS, np.inf))[0]
+
+            summary["stages"][stage] = {
+                "count": len(samples),
+                "rate_per_s": self.rate(stage),
+                "mean_ms": float(samples_array.mean()),
+                "p50_ms": float(np.percentile(samples_array, 50)),
+                "p95_ms": float(np.percentile(samples_array, 95)),
+                "max_ms": float(samples_array.max()),
+                "histogram_ms": dict(zip([f"<{bucket}" for bucket in HISTOGRAM_BUCKETS_MS] + ["more"], histogram.tolist())),
+            }
+
+        return summary
+
+    def export(self, filepath):
+        temp_filepath = f"{filepath}.tmp"
+        with open(temp_filepath, "w") as file:
+            json.dump(self.summary(), file, indent=4)
+        os.replace(temp_filepath, filepath)
+        # Scrapers never read a partially written file
+
+    def start_export(self, filepath, interval=METRICS_INTERVAL):
+        def export_loop():
+            while self.enabled:
+                time.sleep(interval)
+                try:
+                    self.export(filepath)
+                except OSError as e:
+                    print(f"Error exporting metrics: {e}")
+
+        self.exporter = threading.Thread(target=export_loop, daemon=True)
+        self.exporter.start()
+
+METRICS = StageMetrics()
+# Disabled unless set on config or arguments
+
+class StartupReport():
+    def __init__(self, started_at=STARTED_AT):
+        self.started_at = started_at
+        self.lock = threading.Lock()
+        self.times = dict()
+        # Milestone name to seconds since start
+
+    def mark(self, milestone):
+        with self.lock:
+            if milestone in self.times:
+                return
+                # Only first time is reported
+            self.times[milestone] = time.perf_counter() - self.started_at
+
+        print(f"Startup: {milestone} after {self.times[milestone]:.2f}s")
+
+    def report(self):
+        with self.lock:
+            return dict(self.times)
+
+STARTUP = StartupReport()
+
+def load_mediapipe():
+    global mp
+
+    with mediapipe_lock:
+        if mp is None:
+            import mediapipe
+            mp = mediapipe
+            STARTUP.mark("mediapipe imported")
+
+    return mp
+
+def open_path(path):
+    try:
+        if sys.platform == "win32":
+            os.startfile(path)
+        elif sys.platform == "darwin":
+            subprocess.Popen(["open", path])
+        else:
+            subprocess.Popen(["xdg-open", path])
+    except OSError as e:
+        print(f"Error opening {path}: {e}")
+    # Opens file or folder with default application of system,
+    # a missing viewer never fails a save
+
+reserved_names = set()
+reserved_names_lock = threading.Lock()
+
+def unique_session_name(extension):
+    base = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    # Includes date, so names do not collide across days
+
+    with reserved_names_lock:
+        name = base
+        counter = 1
+        while (
+            name in reserved_names or
+            os.path.exists(f"{MAIN_FOLDER}/{name}{extension}") or
+            os.path.exists(f"{SESSIONS_FOLDER}/{name}")
+        ):
+            counter += 1
+            name = f"{base}-{counter}"
+            # Sessions in same second, or saved ones not written yet
+
+        reserved_names.add(name)
+
+    return name
+
+def release_session_name(name):
+    with reserved_names_lock:
+        reserved_names.discard(name)
+    # Once saved, file on disk keeps name taken
+
+class StripIndex():
+    def __init__(self, filepath=None):
+        self.filepath = filepath or f"{DIRECTORY}/{INDEX_FILENAME}"
+        self.thumbnails_folder = f"{os.path.dirname(self.filepath)}/{THUMBNAILS_FOLDERNAME}"
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.filepath, check_same_thread=False)
+        # Shared by save workers and gallery, access is serialized by lock
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS strips ("
+                "id INTEGER PRIMARY KEY, filepath TEXT UNIQUE, timestamp REAL, faces INTEGER, "
+                "width INTEGER, height INTEGER, size INTEGER, frames TEXT)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS strips_timestamp ON strips (timestamp)")
+
+    def add(self, filepath, faces=None, frames=None):
+        with Image.open(filepath) as image:
+            width, height = image.size
+            # Only header is read
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO strips (filepath, timestamp, faces, width, height, size, frames) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filepath, os.path.getmtime(filepath), faces, width, height, os.path.getsize(filepath), frames)
+            )
+
+    def scan(self, folder, on_added=None, cancelled=None, batch_size=50):
+        with self.lock:
+            known = {row[0] for row in self.connection.execute("SELECT filepath FROM strips")}
+
+        added = 0
+        batch = list()
+        for filename in os.listdir(folder):
+            if cancelled is not None and cancelled.is_set():
+                break
+
+            filepath = f"{folder}/{filename}"
+            if filepath in known or not filename.lower().endswith(tuple(OUTPUT_FORMATS[key][1] for key in OUTPUT_FORMATS)):
+                continue
+            if filename.endswith("_web.jpg"):
+                continue
+                # Web copies are not strips
+
+            try:
+                self.add(filepath)
+                added += 1
+                batch.append(filepath)
+            except OSError:
+                pass
+
+            if on_added and len(batch) >= batch_size:
+                on_added(batch)
+                batch = list()
+                # Reported in batches, so gallery fills while scan goes on
+
+        if on_added and batch:
+            on_added(batch)
+
+        return added
+        # Strips saved before index existed
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM strips").fetchone()[0]
+
+    def page(self, offset, limit):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT id, filepath, timestamp, faces, width, height, size, frames FROM strips "
+                "ORDER BY timestamp DESC, filepath DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        # Newest first, path breaks ties so pages never overlap
+
+    def rows(self, filepaths):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT id, filepath, timestamp, faces, width, height, size, frames FROM strips "
+                f"WHERE filepath IN ({', '.join('?' * len(filepaths))})",
+                list(filepaths)
+            ).fetchall()
+
+    def thumbnail(self, filepath):
+        key = hashlib.sha1(f"{filepath}:{os.path.getmtime(filepath)}".encode()).hexdigest()
+        thumbnail_filepath = f"{self.thumbnails_folder}/{key}.jpg"
+        # Row ids change when a strip is indexed again, path and mtime do not
+
+        if not os.path.exists(thumbnail_filepath):
+            if not os.path.exists(self.thumbnails_folder):
+                os.makedirs(self.thumbnails_folder, exist_ok=True)
+
+            with Image.open(filepath) as image:
+                image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                # JPEG strips are decoded at reduced size
+                image = image.convert("RGB")
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                image.save(thumbnail_filepath, "JPEG", quality=80)
+
+        return thumbnail_filepath
+        # Generated once, on first time it is shown
+
+strip_index = None
+
+def get_strip_index():
+    global strip_index
+
+    if strip_index is None or strip_index.filepath != f"{DIRECTORY}/{INDEX_FILENAME}":
+        strip_index = StripIndex()
+
+    return strip_index
+
+class OverlayCache():
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        # Least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, filepath, size):
+        return self.cached((filepath, os.path.getmtime(filepath), size), lambda: self.load(filepath, size))
+        # Changed file gets a new key, old one falls out by LRU
+
+    def alpha(self, filepath, size, bgr=False):
+        return self.cached(
+            (filepath, os.path.getmtime(filepath), size, bgr),
+            lambda: AlphaOverlay(self.get(filepath, size)[0], bgr)
+        )
+        # Premultiplied once per size and channel order
+
+    def cached(self, key, load):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+
+        overlay = load()
+
+        with self.lock:
+            self.items[key] = overlay
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+        return overlay
+
+    def load(self, filepath, size):
+        with Image.open(filepath) as image:
+            if image.mode == "P":
+                image = image.convert("RGBA")
+
+            width, height = size
+            image = image.resize((width or image.size[0], height or image.size[1]))
+            # None on a side keeps original size on it
+
+        mask = image.getchannel("A") if "A" in image.getbands() else None
+        # Precomputed to paste overlay in a single pass
+
+        return image, mask
+
+class AlphaOverlay():
+    def __init__(self, image, bgr=False):
+        rgba = np.asarray(image.convert("RGBA"))
+        if bgr:
+            rgba = rgba[..., [2, 1, 0, 3]]
+            # Preview frames come from OpenCV in BGR
+
+        self.size = image.size
+        rows, columns = np.nonzero(rgba[..., 3])
+        if len(rows) == 0:
+            self.box = None
+            return
+            # Fully transparent, nothing to blend
+
+        self.box = (slice(rows.min(), rows.max() + 1), slice(columns.min(), columns.max() + 1))
+        # Only area covered by overlay is blended
+
+        rgba = rgba[self.box]
+        alpha = rgba[..., 3:].astype(np.uint16)
+
+        self.premultiplied = rgba[..., :3].astype(np.uint16) * alpha
+        self.inverse = np.repeat(255 - alpha, 3, axis=2)
+        # Repeated over channels, broadcasting is slower than reading it
+
+    def apply(self, frame, out=None):
+        if out is None:
+            out = frame.copy()
+        elif out is not frame:
+            out[...] = frame
+
+        if self.box is None:
+            return out
+
+        blended = frame[self.box] * self.inverse
+        blended += self.premultiplied
+        blended += 128
+        blended += blended >> 8
+        out[self.box] = blended >> 8
+        # Same rounding as PIL paste with a mask, in 16 bits
+
+        return out
+
+OVERLAY_CACHE = OverlayCache()
+# Shared between sessions, overlay files do not change during a run
+
+def session_faces(faces):
+    return max(set(faces), key=faces.count) or 1
+    # Gets most common case on faces list, minimum 1
+
+class StripComposer():
+    def __init__(self, border_size=10):
+        self.border_size = border_size
+
+    def compose(self, frames, faces, stamp=None):
+        height, width = frames[0].shape[:2]
+        tiles = ([stamp] if stamp is not None else []) + list(frames)
+        # Stamp goes first, as in ImageProcessor.append_horizontally
+
+        total_width = width * len(tiles) + self.border_size * len(tiles)
+        max_height = height + self.border_size * 2
+        total_height = max_height * faces + self.border_size * (faces - 1)
+
+        canvas = np.full((total_height, total_width, 3), 255, dtype=np.uint8)
+        # Final strip allocated once, white as background
+
+        row = canvas[:max_height]
+        for index, tile in enumerate(tiles):
+            x_offset = self.border_size + index * (width + self.border_size)
+            # Row is shifted by border when stacked vertically
+            tile_height = min(tile.shape[0], max_height - self.border_size)
+            tile_width = min(tile.shape[1], total_width - x_offset)
+
+            if tile_width > 0 and tile_height > 0:
+                row[self.border_size:self.border_size + tile_height, x_offset:x_offset + tile_width] = \
+                    tile[:tile_height, :tile_width, :3]
+                # Clipped to canvas as PIL paste does
+
+        for face in range(1, faces):
+            y_offset = face * (max_height + self.border_size)
+            canvas[y_offset:y_offset + max_height] = row
+            # First row repeated once per face
+
+        return canvas
+
+class StripEncoder():
+    def __init__(self):
+        configActions = get_config()
+
+        self.output_format = str(configActions.get("output_format") or "png").lower()
+        if self.output_format not in OUTPUT_FORMATS:
+            print(f"Output format {self.output_format} not supported, using png")
+            self.output_format = "png"
+
+        self.quality = min(max(configActions.get_int("output_quality", 90), OUTPUT_QUALITIES[0]), OUTPUT_QUALITIES[-1])
+        self.compress_level = min(max(configActions.get_int("png_compress_level", 6), PNG_COMPRESS_LEVELS[0]), PNG_COMPRESS_LEVELS[-1])
+        # Clamped, config file can be edited by hand
+        self.progressive = bool(configActions.get_int("output_progressive", 0))
+        self.web_copy_width = configActions.get_int("web_copy_width", 0)
+        # 0 disables web copy
+
+    def extension(self):
+        return OUTPUT_FORMATS[self.output_format][1]
+
+    def options(self):
+        if self.output_format == "png":
+            return {"compress_level": self.compress_level}
+        elif self.output_format == "jpeg":
+            return {"quality": self.quality, "progressive": self.progressive, "optimize": self.progressive}
+            # Progressive is only supported by JPEG
+
+        return {"quality": self.quality}
+
+    def save(self, image, filename):
+        start = time.monotonic()
+        filepaths = [f"{filename}{self.extension()}"]
+
+        image.save(filepaths[0], OUTPUT_FORMATS[self.output_format][0], **self.options())
+
+        if self.web_copy_width and image.size[0] > self.web_copy_width:
+            height = round(image.size[1] * self.web_copy_width / image.size[0])
+            web_image = image.resize((self.web_copy_width, height), Image.BILINEAR)
+            # Reuses strip already in memory, no decoding is needed
+            filepaths.append(f"{filename}_web.jpg")
+            web_image.save(filepaths[1], "JPEG", quality=80, progressive=True)
+
+        size = sum(os.path.getsize(filepath) for filepath in filepaths)
+        print(f"Encoded {filepaths[0]} as {self.output_format} in {time.monotonic() - start:.2f}s, {size / 1024:.0f} KB")
+
+        return filepaths
+
+class ImageProcessor():
+    def __init__(self):
+        if not os.path.exists(MAIN_FOLDER):
+            os.makedirs(MAIN_FOLDER)
+
+        configActions = get_config()
+        stamp_filepath = configActions.get("stamp_filepath")
+        filter_filepath = configActions.get("filter_filepath")
+
+        self.border_size = 10
+        self.stamp_filepath = stamp_filepath
+        self.filter_filepath = filter_filepath
+
+        self.composer = StripComposer(self.border_size)
+        self.encoder = StripEncoder()
+
+    def apply_filter(self, image):
+        overlay = OVERLAY_CACHE.alpha(self.filter_filepath, image.size)
+
+        return Image.fromarray(overlay.apply(np.asarray(image.convert("RGB"))))
+
+    def filter_frame(self, frame):
+        height, width = frame.shape[:2]
+
+        return OVERLAY_CACHE.alpha(self.filter_filepath, (width, height)).apply(frame)
+        # On a copy, session frames are saved without filter
+
+    def append_horizontally(self, images, width, total_width, max_height):
+        new_im_x = Image.new('RGB', (total_width, max_height), (255, 255, 255))
+
+        x_offset = 0
+        for im in images:
+            new_im_x.paste(im, (x_offset, self.border_size))
+            x_offset += width + self.border_size
+
+        return new_im_x
+
+    def append_vertically(self, image, total_width, max_height, faces):
+        total_height = max_height * faces + self.border_size * (faces - 1)
+        new_im_y = Image.new('RGB', (total_width, total_height), (255, 255, 255))
+
+        y_offset = 0
+        for _ in range(faces):
+            new_im_y.paste(image, (self.border_size, y_offset))
+            y_offset += max_height + self.border_size
+
+        return new_im_y
+
+    def save_session(self, images_list, session_folder):
+        if not os.path.exists(session_folder):
+            os.makedirs(session_folder)
+
+        file_content = ""
+        for index, (image, face) in enumerate(images_list):
+            frame_filename = f"frame_{index}.png"
+            Image.fromarray(image).save(f"{session_folder}/{frame_filename}", compress_level=1)
+            # Lossless but fast, raw frames are only read back by batch mode
+            file_content += f"{frame_filename},{face}\n"
+
+        with open(f"{session_folder}/{SESSION_FACES_FILENAME}", "w") as file:
+            file.write(file_content[:-1])
+        # Written last, so only complete sessions have it
+
+    def load_session(self, session_folder):
+        images_list = list()
+
+        with open(f"{session_folder}/{SESSION_FACES_FILENAME}", "r") as file:
+            for line in file.read().split("\n"):
+                frame_filename, face = line.split(",")
+                with Image.open(f"{session_folder}/{frame_filename}") as image:
+                    images_list.append((np.asarray(image.convert("RGB")), int(face)))
+
+        return images_list
+
+    def save(self, images_list, filename, open_file=True):
+        images = list()
+        faces = list()
+
+        for item in images_list:
+            image, face = item
+
+            if len(self.filter_filepath) and os.path.exists(self.filter_filepath):
+                with METRICS.timer("filter"):
+                    image = self.filter_frame(image)
+                # Applies filter
+            else:
+                print("Filter filepath not exists or not assigned")
+
+            images.append(image)
+            faces.append(face)
+
+        faces = session_faces(faces)
+
+        height = images[0].shape[0]
+
+        stamp = None
+        if len(self.stamp_filepath) and os.path.exists(self.stamp_filepath):
+            stamp_image, _ = OVERLAY_CACHE.get(self.stamp_filepath, (None, height))
+            stamp = np.asarray(stamp_image.convert("RGB"))
+        # Adds stamp resized to common images size
+
+        with METRICS.timer("composition"):
+            strip = self.composer.compose(images, faces, stamp)
+
+        with METRICS.timer("encoding"):
+            filepaths = self.encoder.save(Image.fromarray(strip), filename)
+        # Extension is set by output format
+
+        if open_file:
+            open_path(filepaths[0])
+            # Open photo in file system
+
+        return filepaths
+
+rerender_processor = None
+# One instance per batch re-render pool process
+
+def init_rerender(config_filepath, main_folder, settings):
+    global CONFIG_FILEPATH, MAIN_FOLDER, rerender_processor
+
+    CONFIG_FILEPATH = config_filepath
+    MAIN_FOLDER = main_folder
+    # Spawned workers import module again, arguments of parent are not set there
+
+    configActions = get_config()
+    for param, value in settings.items():
+        configActions.set(param, value)
+    # Same format and overlays parent used to check finished strips
+
+    rerender_processor = ImageProcessor()
+
+def rerender_session(job):
+    session_folder, filename = job
+
+    partial_filepaths = rerender_processor.save(
+        rerender_processor.load_session(session_folder), f"{filename}.partial", open_file=False
+    )
+    for partial_filepath in reversed(partial_filepaths):
+        os.replace(partial_filepath, partial_filepath.replace(f"{filename}.partial", filename))
+    # Only finished strips have final name, so interrupted runs can resume.
+    # Main strip is renamed last, as it marks the session as done
+
+    return f"{filename}{rerender_processor.encoder.extension()}"
+
+def rerender_sessions(sessions_folder, output_folder, workers=None):
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    sessions = sorted(
+        name for name in os.listdir(sessions_folder)
+        if os.path.exists(f"{sessions_folder}/{name}/{SESSION_FACES_FILENAME}")
+    )
+    extension = StripEncoder().extension()
+    jobs = [
+        (f"{sessions_folder}/{name}", f"{output_folder}/{name}") for name in sessions
+        if not os.path.exists(f"{output_folder}/{name}{extension}")
+    ]
+    print(f"{len(sessions)} sessions found, {len(sessions) - len(jobs)} already rendered")
+
+    if not jobs:
+        return
+
+    start = time.monotonic()
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=init_rerender,
+        initargs=(CONFIG_FILEPATH, MAIN_FOLDER, get_config().get_all())
+    ) as pool:
+        for done, filename in enumerate(pool.imap_unordered(rerender_session, jobs), 1):
+            print(f"[{done}/{len(jobs)}] {filename}")
+
+    elapsed = time.monotonic() - start
+    print(f"Rendered {len(jobs)} strips in {elapsed:.2f}s ({len(jobs) / elapsed:.2f} strips/s)")
+
+class SavePipeline(QtCore.QObject):
+    saved = QtCore.pyqtSignal(str, float)
+    # Filename and seconds spent saving it
+    failed = QtCore.pyqtSignal(str, str)
+    # Filename and error message
+
+    def __init__(self, imageProcessor, workers=2, open_files=True):
+        super().__init__()
+
+        self.imageProcessor = imageProcessor
+        self.open_files = open_files
+        # Kiosk without display has no viewer to open strips on
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        self.lock = threading.Lock()
+        self.pending = 0
+        # Jobs queued or running
+
+    def depth(self):
+        with self.lock:
+            return self.pending
+
+    def submit(self, images_list, filename, session_folder=None):
+        with self.lock:
+            self.pending += 1
+
+        return self.executor.submit(self.run, images_list, filename, session_folder, time.monotonic())
+
+    def run(self, images_list, filename, session_folder, queued_at):
+        started_at = time.monotonic()
+        name = os.path.basename(filename)
+
+        try:
+            filename = self.imageProcessor.save(images_list, filename, self.open_files)[0]
+
+            if session_folder:
+                self.imageProcessor.save_session(images_list, session_folder)
+                # After strip, so guests get it first
+
+            get_strip_index().add(filename, session_faces([face for _, face in images_list]), session_folder)
+            # Listed on gallery without scanning folder
+        except Exception as e:
+            print(f"Error saving {filename}: {e}")
+            self.failed.emit(filename, str(e))
+            raise
+        finally:
+            release_session_name(name)
+
+            with self.lock:
+                self.pending -= 1
+
+        elapsed = time.monotonic() - started_at
+        print(f"Saved {filename} in {elapsed:.2f}s (waited {started_at - queued_at:.2f}s, {self.depth()} pending)")
+        self.saved.emit(filename, elapsed)
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
+        # Queued jobs are still completed when not waiting
+
+def configure_capture(cap, width, height, fps):
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    # Grabber drains any other buffered frame
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+    # Set before size, raw formats fall to a few frames per second on USB at large sizes
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_FPS, fps)
+
+    return cap
+
+class ReplaySource():
+    live = False
+    # Recorded frames are never stale, grabber does not drain them
+
+    def __init__(self, fps=30, free_run=False, loop=True):
+        self.fps = fps
+        self.free_run = free_run
+        # Delivers next frame as soon as it is asked for
+        self.loop = loop
+        self.next_time = None
+
+    def pace(self):
+        if self.free_run:
+            return
+
+        now = time.monotonic()
+        if self.next_time is None or now - self.next_time > 1.0 / self.fps:
+            self.next_time = now
+            # Starting, or consumer fell behind, no burst to catch up
+
+        time.sleep(max(0.0, self.next_time - now))
+        self.next_time += 1.0 / self.fps
+
+    def grab(self):
+        self.pace()
+
+        if self.grabFrame():
+            return True
+
+        if not self.loop:
+            return False
+
+        self.rewind()
+        return self.grabFrame()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+
+        return self.retrieve()
+
+    def set(self, prop, value):
+        return False
+        # Size and rate are the ones recorded
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+
+        return 0
+
+class VideoFileSource(ReplaySource):
+    def __init__(self, filepath, free_run=False, loop=True):
+        self.cap = cv2.VideoCapture(filepath)
+        super().__init__(self.cap.get(cv2.CAP_PROP_FPS) or 30, free_run, loop)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def grabFrame(self):
+        return self.cap.grab()
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+class ImageDirectorySource(ReplaySource):
+    def __init__(self, directory, fps=30, free_run=False, loop=True):
+        super().__init__(fps, free_run, loop)
+
+        self.filepaths = [
+            f"{directory}/{filename}" for filename in sorted(os.listdir(directory))
+            if filename.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        self.index = -1
+
+    def isOpened(self):
+        return len(self.filepaths) > 0
+
+    def grabFrame(self):
+        if self.index + 1 >= len(self.filepaths):
+            return False
+
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        frame = cv2.imread(self.filepaths[self.index])
+        # Decoded on retrieve, like a video frame
+        return frame is not None, frame
+
+    def rewind(self):
+        self.index = -1
+
+    def get(self, prop):
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT) and self.filepaths:
+            height, width = cv2.imread(self.filepaths[0]).shape[:2]
+            return width if prop == cv2.CAP_PROP_FRAME_WIDTH else height
+
+        return super().get(prop)
+
+    def release(self):
+        pass
+
+def open_frame_source(source, free_run=False):
+    if isinstance(source, int) or str(source).isdigit():
+        return cv2.VideoCapture(int(source))
+        # Live camera, paced by its own delivery
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, free_run=free_run)
+
+    return VideoFileSource(source, free_run=free_run)
+
+def configured_source():
+    if FRAME_SOURCE is not None:
+        return FRAME_SOURCE
+
+    return get_config().get_int("camera_index")
+
+def measure_fps(cap, frames=PROBE_FRAMES):
+    for _ in range(2):
+        cap.grab()
+    # First frames after a resolution change come late
+
+    grabbed = 0
+    start = time.monotonic()
+    for _ in range(frames):
+        if not cap.grab():
+            break
+        grabbed += 1
+
+    elapsed = time.monotonic() - start
+    measured = grabbed / elapsed if grabbed and elapsed > 0 else 0.0
+
+    nominal = cap.get(cv2.CAP_PROP_FPS)
+    return min(measured, nominal) if nominal > 0 else measured
+    # Buffered frames may be grabbed faster than camera delivers them
+
+def device_signature():
+    if sys.platform.startswith("linux"):
+        return sorted(glob.glob("/dev/video*"))
+
+    return None
+    # No cheap way to list devices elsewhere, refresh is done from control panel
+
+def probe_camera(index):
+    cap = cv2.VideoCapture(index)
+
+    try:
+        if not cap.isOpened():
+            return None
+
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        # Probed on same format configure_capture streams with
+
+        resolutions = list()
+        for width, height in PROBE_RESOLUTIONS:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            resolution = [int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))]
+            # Camera falls back to closest supported resolution
+
+            if resolution not in [known[:2] for known in resolutions]:
+                resolutions.append(resolution + [round(measure_fps(cap), 1)])
+                # Many cameras lower their rate on bigger resolutions
+
+        return {"index": index, "resolutions": resolutions}
+    finally:
+        cap.release()
+        # Probed cameras are never kept open
+
+class CameraInventory():
+    def __init__(self, limit=10, timeout=PROBE_TIMEOUT):
+        self.limit = limit
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.cameras = list()
+        self.probing = None
+        self.listeners = list()
+
+    def filepath(self):
+        return f"{os.path.dirname(CONFIG_FILEPATH)}/{CAMERAS_FILENAME}"
+        # Next to config file, which can be changed by arguments
+
+    def load(self):
+        try:
+            with open(self.filepath(), "r") as file:
+                inventory = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(inventory, dict) or not inventory.get("cameras"):
+            return False
+            # Older format, or no camera was found last time
+
+        if inventory.get("devices") != device_signature():
+            return False
+            # Cameras plugged or unplugged since last probe
+
+        cameras = inventory["cameras"]
+        if any(len(resolution) != 3 for camera in cameras for resolution in camera["resolutions"]):
+            return False
+            # Probed before rate was measured on each resolution
+
+        with self.lock:
+            self.cameras = cameras
+
+        return True
+
+    def save(self):
+        with open(self.filepath(), "w") as file:
+            json.dump({"devices": device_signature(), "cameras": self.get_all()}, file, indent=4)
+
+    def probe(self, busy=()):
+        results = dict()
+        threads = list()
+
+        for index in range(self.limit + 1):
+            if index in busy:
+                continue
+                # Open on a window, it would not answer probing
+
+            thread = threading.Thread(
+                target=lambda index=index: results.__setitem__(index, probe_camera(index)),
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        # All indexes at once, missing devices can block for seconds
+
+        deadline = time.monotonic() + self.timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        # Devices still blocked after timeout are left out
+
+        with self.lock:
+            results.update({camera["index"]: camera for camera in self.cameras if camera["index"] in busy})
+            # Cameras in use keep their last probe
+            self.cameras = [results[index] for index in sorted(results) if results[index]]
+
+        self.save()
+        print(f"Found cameras: {self.indexes()}")
+
+        for callback in list(self.listeners):
+            callback()
+        # Called on probing thread
+
+    def probe_async(self, busy=()):
+        if self.isProbing():
+            return
+            # Already probing, cameras would be opened twice
+
+        self.probing = threading.Thread(target=self.probe, args=(tuple(busy),), daemon=True)
+        self.probing.start()
+
+    def isProbing(self):
+        return self.probing is not None and self.probing.is_alive()
+
+    def subscribe(self, callback):
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def wait(self):
+        if self.probing:
+            self.probing.join(self.timeout)
+
+    def get_all(self):
+        with self.lock:
+            return list(self.cameras)
+
+    def indexes(self):
+        return [camera["index"] for camera in self.get_all()]
+
+    def sustained_resolution(self, index, fps):
+        for camera in self.get_all():
+            if camera["index"] != index:
+                continue
+
+            sustained = [resolution for resolution in camera["resolutions"] if resolution[2] >= fps * SUSTAINED_FPS_FRACTION]
+            if sustained:
+                return tuple(max(sustained, key=lambda resolution: resolution[0] * resolution[1])[:2])
+
+        return None
+        # Largest one camera delivers at configured rate
+
+    def next_index(self, index):
+        indexes = self.indexes()
+        if not indexes:
+            return None
+
+        following = [i for i in indexes if i > index]
+        return following[0] if following else indexes[0]
+        # Cycles back to first camera
+
+CAMERA_INVENTORY = CameraInventory()
+
+def still_resolution(source, fps, default=DEFAULT_STILL_RESOLUTION):
+    configActions = get_config()
+    width = configActions.get_int("still_width", 0)
+    height = configActions.get_int("still_height", 0)
+
+    if width > 0 and height > 0:
+        return width, height
+        # Set on config, even if camera streams it slower
+
+    if isinstance(source, int) or str(source).isdigit():
+        return CAMERA_INVENTORY.sustained_resolution(int(source), fps) or default
+        # Stream runs at still size, so it must keep configured rate
+    return default
+
+def preview_frame(frame, preview_width):
+    height, width = frame.shape[:2]
+    if not preview_width or width <= preview_width:
+        return frame
+
+    with METRICS.timer("downscale"):
+        return cv2.resize(frame, (preview_width, round(height * preview_width / width)), interpolation=cv2.INTER_AREA)
+    # Preview, detection and burst sharpness run on this copy, stills on full frame
+
+class Warmup():
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.detector = None
+        self.detector_confidence = None
+        self.detector_thread = None
+
+        self.capture = None
+        self.capture_args = None
+        self.capture_thread = None
+
+        self.abandoned = set()
+        # Warm-ups given up on, released by their thread when it finishes
+
+    def start(self, capture_args, confidence):
+        self.capture_args = capture_args
+        self.capture_thread = threading.Thread(target=self.warmCapture, daemon=True)
+        self.capture_thread.start()
+
+        self.detector_confidence = confidence
+        self.detector_thread = threading.Thread(target=self.warmDetector, daemon=True)
+        self.detector_thread.start()
+        # Camera open waits on driver, model load on CPU, both run at once
+
+    def warmCapture(self):
+        CAMERA_INVENTORY.wait()
+        # Probing may be holding cameras on first run
+
+        cap = open_frame_source(self.capture_args[0], FREE_RUN)
+        if not cap.isOpened() or not cap.read()[0]:
+            cap.release()
+            print(f"Camera {self.capture_args[0]} could not be warmed up")
+            return
+
+        with self.lock:
+            if "capture" in self.abandoned:
+                cap.release()
+                return
+                # Window opened camera cold meanwhile
+            self.capture = cap
+        STARTUP.mark("camera warm")
+
+    def warmDetector(self):
+        detector = load_mediapipe().solutions.face_detection.FaceDetection(self.detector_confidence)
+        detector.process(np.zeros((128, 128, 3), dtype=np.uint8))
+        # First process call loads model graph
+
+        with self.lock:
+            if "detector" in self.abandoned:
+                detector.close()
+                return
+            self.detector = detector
+        STARTUP.mark("model warm")
+
+    def takeCapture(self, args):
+        if self.capture_thread is None or tuple(args) != tuple(self.capture_args):
+            return None
+
+        self.capture_thread.join(WARMUP_TIMEOUT)
+        # Opening same camera twice would fail, waits for warm-up instead
+
+        with self.lock:
+            if self.capture is None and self.capture_thread.is_alive():
+                self.abandoned.add("capture")
+                print(f"Camera warm-up took over {WARMUP_TIMEOUT}s, opening it cold")
+                return None
+                # Stuck driver or probe does not freeze GUI thread
+
+            cap, self.capture = self.capture, None
+            return cap
+        # Handed over once, later windows open their own
+
+    def takeDetector(self, confidence):
+        if self.detector_thread is None or confidence != self.detector_confidence:
+            return None
+
+        self.detector_thread.join(WARMUP_TIMEOUT)
+
+        with self.lock:
+            if self.detector is None and self.detector_thread.is_alive():
+                self.abandoned.add("detector")
+                return None
+
+            detector, self.detector = self.detector, None
+            return detector
+
+    def close(self):
+        with self.lock:
+            if self.capture:
+                self.capture.release()
+                self.capture = None
+
+WARMUP = Warmup()
+# Started by main, captures and detectors fall back to cold start otherwise
+
+def sharpness(frames, width=320):
+    scale = min(1.0, width / frames[0].shape[1])
+    grays = np.stack([
+        cv2.cvtColor(cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        for frame in frames
+    ]).astype(np.float32)
+    # Downscaled, so scoring a burst fits in a few milliseconds
+
+    laplacian = (
+        grays[:, :-2, 1:-1] + grays[:, 2:, 1:-1] +
+        grays[:, 1:-1, :-2] + grays[:, 1:-1, 2:] -
+        4 * grays[:, 1:-1, 1:-1]
+    )
+    # Same kernel as cv2.Laplacian, on all frames at once
+
+    return laplacian.reshape(len(frames), -1).var(axis=1)
+
+def select_best_frame(frames, live_counts):
+    expected = max(set(live_counts), key=live_counts.count)
+    # Most common live people count on burst, as ImageProcessor.save does
+
+    scores = sharpness(frames)
+    scores[np.array(live_counts) != expected] = -1
+    # Frames offered with inconsistent live count are only used if no other
+
+    return int(np.argmax(scores))
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    # Bytes on macOS, kilobytes on Linux
+
+class FramePool():
+    def __init__(self, images_session, shape, sessions=2):
+        self.images_session = images_session
+        self.shape = shape
+        # Height, width and channels of captured frames
+
+        self.lock = threading.Lock()
+        self.free = [self.allocate() for _ in range(sessions)]
+        # One session being captured and one being saved
+        self.allocations = sessions
+
+    def allocate(self):
+        return np.empty((self.images_session, *self.shape), dtype=np.uint8)
+
+    def fits(self, images_session, shape):
+        return self.images_session == images_session and self.shape == shape
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+
+            self.allocations += 1
+            # Only if saves fall behind captures
+
+        return self.allocate()
+
+    def release(self, buffers):
+        with self.lock:
+            if buffers.shape[1:] == self.shape and len(buffers) == self.images_session:
+                self.free.append(buffers)
+
+class FrameGrabber(QtCore.QObject):
+    frameReady = QtCore.pyqtSignal()
+    # Emitted once per new frame, until it is read
+
+    def __init__(self, cap, fps=30, preview_width=None):
+        super().__init__()
+
+        self.cap = cap
+        self.nominal_interval = 1.0 / fps
+        self.setSourceMode(cap)
+        self.preview_width = preview_width
+        # Frames are downscaled here, out of GUI thread
+
+        self.consumed = threading.Event()
+        # Free run waits until each frame is read, instead of dropping it
+
+        self.lock = threading.Lock()
+        self.frame = None
+        self.still = None
+        # Full size frame the preview one was made from
+        self.frame_id = 0
+        self.frame_time = 0.0
+        # Only newest frame is kept, older ones are overwritten
+        self.notified = False
+        self.timestamps = deque(maxlen=30)
+        self.last_grab = None
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+    def setSourceMode(self, cap):
+        self.drain = getattr(cap, "live", True)
+        # Live cameras only, other sources never have stale frames
+        self.free_run = getattr(cap, "free_run", False)
+
+    def setCapture(self, cap):
+        was_running = self.running
+        self.stop()
+
+        self.cap = cap
+        self.setSourceMode(cap)
+        with self.lock:
+            self.frame = None
+            self.timestamps.clear()
+        self.last_grab = None
+
+        if was_running:
+            self.start()
+
+    def setFPS(self, fps):
+        self.nominal_interval = 1.0 / fps
+
+    def cameraInterval(self):
+        with self.lock:
+            timestamps = list(self.timestamps)
+
+        if len(timestamps) < 2:
+            return self.nominal_interval
+
+        return float(np.median(np.diff(timestamps)))
+        # Real delivery rate of camera, robust to a few late frames
+
+    def cameraFPS(self):
+        return 1.0 / self.cameraInterval()
+
+    def grabFresh(self):
+        interval = max(self.nominal_interval, self.cameraInterval())
+        stale = int((time.monotonic() - self.last_grab) / interval) - 1 if self.drain and self.last_grab else 0
+        # Frames camera may have buffered since last grab, besides newest one
+        drained = 0
+
+        while True:
+            grab_start = time.monotonic()
+            if not self.cap.grab():
+                return False
+            self.last_grab = time.monotonic()
+
+            if drained >= min(stale, MAX_DRAINED_FRAMES) or self.last_grab - grab_start > interval * FRESH_FRAME_FRACTION:
+                break
+            # Only grab call is timed, a frame buffered while last one was
+            # decoded returns at once but is fresh unless loop stalled
+            drained += 1
+
+        METRICS.count("drained_frames", drained)
+        return True
+
+    def run(self):
+        while self.running:
+            with METRICS.timer("grab"):
+                ret = self.grabFresh()
+                # Blocks until camera delivers a frame, out of GUI thread
+
+            with METRICS.timer("retrieve"):
+                frame = self.cap.retrieve()[1] if ret else None
+                # Decoding cost, timed apart from waiting for camera
+
+            if frame is None:
+                time.sleep(0.01)
+                continue
+                # Not initialized frame, waits a bit to not spin
+
+            preview = preview_frame(frame, self.preview_width)
+
+            now = time.monotonic()
+            with self.lock:
+                self.frame = preview
+                self.still = frame
+                self.frame_id += 1
+                self.frame_time = now
+                self.timestamps.append(now)
+
+                notify = not self.notified
+                self.notified = True
+
+            if notify:
+                self.frameReady.emit()
+                # Queued to GUI thread, never more than one pending
+
+            if self.free_run:
+                while self.running and not self.consumed.wait(0.1):
+                    pass
+                self.consumed.clear()
+                # Paced by consumer, every frame goes through pipeline
+
+    def read(self):
+        with self.lock:
+            self.notified = False
+            self.consumed.set()
+            return self.frame_id, self.frame
+
+    def readWithStill(self):
+        with self.lock:
+            self.notified = False
+            self.consumed.set()
+            return self.frame_id, self.frame, self.still
+        # Both belong to same camera frame
+
+    def lastFrameTime(self):
+        with self.lock:
+            return self.frame_time
+
+class FramePacer():
+    def __init__(self, fps):
+        self.setFPS(fps)
+
+        self.slowdown = 1.0
+        # Multiplies display interval while GUI thread is overloaded
+        self.load = 0.0
+        self.last_shown = None
+        self.shown = deque(maxlen=60)
+
+    def setFPS(self, fps):
+        self.requested_fps = fps
+        self.min_interval = 1.0 / fps
+
+    def shouldShow(self, now, camera_interval):
+        if self.slowdown == 1.0 and camera_interval >= self.min_interval * 0.9:
+            return True
+            # Camera is not faster than requested rate, every frame is shown
+
+        interval = max(self.min_interval, camera_interval) * self.slowdown
+
+        return self.last_shown is None or now - self.last_shown >= interval * 0.9
+        # Tolerance against jitter on frames delivery
+
+    def frameShown(self, now, busy, camera_interval):
+        self.last_shown = now
+        self.shown.append(now)
+
+        self.load = 0.9 * self.load + 0.1 * busy / max(self.min_interval, camera_interval)
+        # Share of frame interval spent between grab and display
+
+        if self.load > PACER_HIGH_LOAD:
+            self.slowdown = min(PACER_MAX_SLOWDOWN, self.slowdown * 1.25)
+        elif self.load < PACER_LOW_LOAD:
+            self.slowdown = max(1.0, self.slowdown * 0.95)
+
+    def achievedFPS(self):
+        if len(self.shown) < 2 or self.shown[-1] == self.shown[0]:
+            return 0.0
+
+        return (len(self.shown) - 1) / (self.shown[-1] - self.shown[0])
+
+def parse_detections(result):
+    if not result or not result.detections:
+        return 0, list()
+
+    boxes = list()
+    for detection in result.detections:
+        box = detection.location_data.relative_bounding_box
+        boxes.append((box.xmin, box.ymin, box.width, box.height, detection.score[0]))
+        # Relative to frame size, so they can be drawn on any resolution
+
+    return len(boxes), boxes
+
+def best_confidence(samples):
+    # Each sample is a list of detection scores and expected people on it
+    scores = np.array(sorted({score for sample, _ in samples for score in sample}))
+    scores = scores[(scores > CALIBRATION_MIN_CONFIDENCE) & (scores < 1.0)]
+
+    edges = np.concatenate(([CALIBRATION_MIN_CONFIDENCE], scores, [1.0]))
+    thresholds = (edges[:-1] + edges[1:]) / 2
+    # People counted only change on a score, so midpoints cover all cases
+
+    errors = np.zeros(len(thresholds))
+    for sample, expected in samples:
+        sample = np.asarray(sample)
+        counted = (sample[:, None] >= thresholds[None, :]).sum(axis=0)
+        errors += np.abs(counted - expected)
+
+    best = np.flatnonzero(errors == errors.min())
+    widths = edges[best + 1] - edges[best]
+    # On ties, widest interval is the one most robust to noise
+
+    return float(thresholds[best[np.argmax(widths)]])
+
+class CalibrationEngine():
+    def __init__(self, people, frames=CALIBRATION_FRAMES):
+        self.people = people
+        self.frames = frames
+        self.samples = list()
+
+    def add(self, boxes):
+        self.samples.append(([box[4] for box in boxes], self.people))
+        # Keeps scores only, threshold is computed once at the end
+
+    def done(self):
+        return len(self.samples) >= self.frames
+
+    def result(self):
+        return best_confidence(self.samples)
+
+offline_face_detection_fn = None
+# One instance per calibration pool process
+
+def init_offline_calibration(config_filepath, min_confidence):
+    global CONFIG_FILEPATH, offline_face_detection_fn
+
+    CONFIG_FILEPATH = config_filepath
+    # Spawned workers import module again, arguments of parent are not set there
+    offline_face_detection_fn = load_mediapipe().solutions.face_detection.FaceDetection(min_confidence)
+
+def offline_scores(filepath):
+    frame = cv2.imread(filepath)
+    if frame is None:
+        return filepath, None
+
+    result = offline_face_detection_fn.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    _, boxes = parse_detections(result)
+
+    return filepath, [box[4] for box in boxes]
+
+def read_labels(filepath):
+    labels = dict()
+
+    with open(filepath, "r") as file:
+        for line in file.read().split("\n"):
+            if not line.strip():
+                continue
+
+            filename, people = line.split(",")
+            labels[filename.strip()] = int(people)
+            # Same format as config file, one image per line
+
+    return labels
+
+def calibrate_directory(directory, labels_filepath=None, workers=None):
+    labels = read_labels(labels_filepath or f"{directory}/labels.csv")
+    label_of = {
+        f"{directory}/{filename}": filename for filename in sorted(labels)
+        if filename.lower().endswith(IMAGE_EXTENSIONS)
+    }
+    # Label keys can name images on subfolders
+
+    if not label_of:
+        print(f"No labelled images found on {directory}")
+        return None
+
+    start = time.monotonic()
+    samples = list()
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=init_offline_calibration,
+        initargs=(CONFIG_FILEPATH, CALIBRATION_MIN_CONFIDENCE)
+    ) as pool:
+        for filepath, scores in pool.imap_unordered(offline_scores, list(label_of), chunksize=8):
+            if scores is None:
+                print(f"Could not read {filepath}")
+                continue
+
+            samples.append((scores, labels[label_of[filepath]]))
+
+    if not samples:
+        return None
+
+    face_detection_coeff = best_confidence(samples)
+    matches = sum(
+        sum(score >= face_detection_coeff for score in scores) == expected
+        for scores, expected in samples
+    )
+    print(
+        f"Calibrated face detection coeff: {face_detection_coeff:.3f} "
+        f"({matches}/{len(samples)} images match, {time.monotonic() - start:.2f}s)"
+    )
+
+    configActions = get_config()
+    configActions.set("face_detection_coeff", str(face_detection_coeff))
+    configActions.save()
+
+    return face_detection_coeff
+
+class DetectionScheduler():
+    def __init__(self, detect_fn, interval=1, scale=1.0, min_tracked=0.6):
+        self.detect_fn = detect_fn
+        self.interval = interval
+        # Frames between full detections, 1 detects on every frame
+        self.scale = scale
+        # Detection and tracking run on a downscaled copy
+        self.min_tracked = min_tracked
+        # Detects again before interval if fewer points are tracked
+
+        self.previous_gray = None
+        self.boxes = list()
+        self.points = list()
+        self.frames_since_detection = None
+
+        self.detections = 0
+        self.tracked = 0
+        self.detection_time = 0.0
+        self.tracking_time = 0.0
+
+        self.schedule_lock = threading.Lock()
+        self.pending_schedule = None
+        # Set from any thread, applied by thread running process
+
+    def setSchedule(self, interval, scale):
+        with self.schedule_lock:
+            self.pending_schedule = (interval, scale)
+
+    def applySchedule(self):
+        with self.schedule_lock:
+            schedule, self.pending_schedule = self.pending_schedule, None
+
+        if schedule is not None and schedule != (self.interval, self.scale):
+            self.interval, self.scale = schedule
+            self.previous_gray = None
+            # Tracked points belong to old scale, detects on next frame
+
+    def process(self, frame):
+        self.applySchedule()
+
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+        if self.interval <= 1:
+            return self.runDetection(frame, None)
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if self.previous_gray is None or self.frames_since_detection + 1 >= self.interval:
+            return self.runDetection(frame, gray)
+
+        start = time.process_time()
+        confidence = self.track(gray)
+        self.tracking_time += time.process_time() - start
+
+        if confidence < self.min_tracked:
+            return self.runDetection(frame, gray)
+
+        self.tracked += 1
+        return len(self.boxes), self.boxes
+
+    def runDetection(self, frame, gray):
+        start = time.process_time()
+
+        people, boxes = self.detect_fn(frame)
+        # Boxes are relative, so they apply to full size frame too
+
+        self.boxes = boxes
+        self.frames_since_detection = 0
+        self.previous_gray = gray
+
+        if gray is not None:
+            self.points = [self.boxPoints(gray, box) for box in boxes]
+
+        self.detections += 1
+        self.detection_time += time.process_time() - start
+
+        return people, boxes
+
+    def boxPoints(self, gray, box):
+        height, width = gray.shape
+        xmin, ymin, box_width, box_height, _ = box
+
+        mask = np.zeros_like(gray)
+        mask[
+            max(0, int(ymin * height)):max(0, int((ymin + box_height) * height)),
+            max(0, int(xmin * width)):max(0, int((xmin + box_width) * width))
+        ] = 255
+
+        points = cv2.goodFeaturesToTrack(gray, 20, 0.01, 3, mask=mask)
+        return points if points is not None else np.empty((0, 1, 2), dtype=np.float32)
+
+    def track(self, gray):
+        self.frames_since_detection += 1
+
+        if not self.boxes:
+            self.previous_gray = gray
+            return 1.0
+            # Nothing to track, new faces are found on next detection
+
+        counts = [len(points) for points in self.points]
+        if min(counts) == 0:
+            return 0.0
+
+        points = np.concatenate(self.points)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, points, None)
+        # All boxes tracked on a single call
+        status = status.ravel() == 1
+
+        height, width = gray.shape
+        confidence = 1.0
+        boxes = list()
+        new_points = list()
+
+        start = 0
+        for box, count in zip(self.boxes, counts):
+            box_status = status[start:start + count]
+            box_moved = moved[start:start + count][box_status]
+            shift = np.median(box_moved - points[start:start + count][box_status], axis=0) if len(box_moved) else np.zeros((1, 2))
+            start += count
+
+            confidence = min(confidence, box_status.mean())
+
+            xmin, ymin, box_width, box_height, score = box
+            boxes.append((xmin + shift[0][0] / width, ymin + shift[0][1] / height, box_width, box_height, score))
+            new_points.append(box_moved.reshape(-1, 1, 2))
+
+        self.boxes = boxes
+        self.points = new_points
+        self.previous_gray = gray
+
+        return confidence
+
+    def stats(self):
+        frames = self.detections + self.tracked
+
+        return {
+            "frames": frames,
+            "detections": self.detections,
+            "cpu_ms_per_frame": (self.detection_time + self.tracking_time) * 1000 / frames if frames else 0.0,
+        }
+
+class DetectionWorker(QtCore.QThread):
+    detected = QtCore.pyqtSignal(int, list)
+    # Number of faces and boxes as (xmin, ymin, width, height, score)
+
+    def __init__(self, confidence=0.8, interval=1, scale=1.0):
+        super().__init__()
+
+        self.scheduler = DetectionScheduler(self.detect, interval, scale)
+        # Used for live stream only, detect runs on full frame
+
+        self.confidence = confidence
+        self.face_detection_fn = None
+        self.face_detection_fn_confidence = None
+        # Instance is created lazily by the thread that uses it
+
+        self.queue = queue.Queue(maxsize=1)
+        self.detect_lock = threading.Lock()
+        self.running = False
+
+        self.results_lock = threading.Lock()
+        self.people = 0
+        self.boxes = list()
+
+    def setConfidence(self, confidence):
+        self.confidence = confidence
+        # Detection instance is rebuilt on next processed frame
+
+    def setSchedule(self, interval, scale):
+        self.scheduler.setSchedule(interval, scale)
+        # Config listeners run on any thread, worker applies it before next frame
+
+    def submit(self, frame):
+        item = (frame, time.monotonic())
+        # Submit time, so latency includes waiting on queue
+
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            # Drops stale frame, newest one wins
+
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                pass
+
+    def detect(self, frame):
+        with METRICS.timer("conversion"):
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # OpenCV yields frames in BGR format, MediaPipe expects RGB
+
+        with self.detect_lock:
+            if self.face_detection_fn_confidence != self.confidence:
+                if self.face_detection_fn:
+                    self.face_detection_fn.close()
+                    # Releases graph resources of old instance
+
+                self.face_detection_fn = (
+                    WARMUP.takeDetector(self.confidence) or
+                    load_mediapipe().solutions.face_detection.FaceDetection(self.confidence)
+                )
+                self.face_detection_fn_confidence = self.confidence
+
+            result = self.face_detection_fn.process(frame)
+
+        return parse_detections(result)
+
+    def latest(self):
+        with self.results_lock:
+            return self.people, self.boxes
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        super().start()
+
+    def stop(self):
+        self.running = False
+        self.wait(1000)
+
+    def run(self):
+        while self.running:
+            try:
+                frame, submitted_at = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            with METRICS.timer("detection"):
+                people, boxes = self.scheduler.process(frame)
+            STARTUP.mark("first detection")
+
+            if METRICS.enabled:
+                METRICS.record("detection_latency", time.monotonic() - submitted_at)
+                # Submit to result, what preview boxes lag behind
+
+            with self.results_lock:
+                self.people = people
+                self.boxes = boxes
+
+            self.detected.emit(people, boxes)
+            # Queued to GUI thread by Qt
+
+class DetectionClient(QtCore.QObject):
+    detected = QtCore.pyqtSignal(int, list)
+    # Same interface as DetectionWorker, detection runs on shared pool
+
+    def __init__(self, pool, name, confidence=0.8, interval=1, scale=1.0):
+        super().__init__()
+
+        self.pool = pool
+        self.name = name
+        self.confidence = confidence
+        self.scheduler = DetectionScheduler(self.detect, interval, scale)
+        # Tracking state belongs to one camera, pool never runs it twice at once
+
+        self.running = False
+
+        self.results_lock = threading.Lock()
+        self.people = 0
+        self.boxes = list()
+
+        self.submitted = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=100)
+        self.results = deque(maxlen=100)
+        # Submit to result seconds, and result times for rate
+
+    def setConfidence(self, confidence):
+        self.confidence = confidence
+
+    def setSchedule(self, interval, scale):
+        self.scheduler.setSchedule(interval, scale)
+        # Applied by pool worker before next frame of this camera
+
+    def submit(self, frame):
+        if self.running:
+            self.pool.submit(self, frame)
+
+    def detect(self, frame):
+        return self.pool.detect(frame, self.confidence)
+
+    def latest(self):
+        with self.results_lock:
+            return self.people, self.boxes
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        self.pool.discard(self)
+
+    def result(self, people, boxes, submitted_at):
+        now = time.monotonic()
+
+        with self.results_lock:
+            self.people = people
+            self.boxes = boxes
+            self.latencies.append(now - submitted_at)
+            self.results.append(now)
+
+        if METRICS.enabled:
+            METRICS.record("detection_latency", now - submitted_at)
+
+        self.detected.emit(people, boxes)
+
+    def report(self):
+        with self.results_lock:
+            latencies = sorted(self.latencies)
+            results = list(self.results)
+
+        rate = (len(results) - 1) / (results[-1] - results[0]) if len(results) > 1 and results[-1] > results[0] else 0.0
+
+        return {
+            "detections_per_s": rate,
+            "latency_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+            "submitted": self.submitted,
+            "dropped": self.dropped
+        }
+
+class DetectionPool():
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.threads = list()
+        self.running = False
+
+        self.condition = threading.Condition()
+        self.pending = OrderedDict()
+        # Client to newest frame and submit time, older frames of same camera are dropped
+        self.busy = set()
+        # Clients being processed, their next frame waits
+
+        self.local = threading.local()
+        # Each worker thread owns its detectors, MediaPipe graphs are not shared
+
+    def client(self, name, confidence=0.8, interval=1, scale=1.0):
+        return DetectionClient(self, name, confidence, interval, scale)
+
+    def submit(self, client, frame):
+        with self.condition:
+            client.submitted += 1
+
+            if client in self.pending:
+                client.dropped += 1
+                del self.pending[client]
+            self.pending[client] = (frame, time.monotonic())
+            # Moved to end, cameras are served in arrival order
+
+            self.condition.notify()
+
+    def discard(self, client):
+        with self.condition:
+            self.pending.pop(client, None)
+
+    def detect(self, frame, confidence):
+        detectors = getattr(self.local, "detectors", None)
+        if detectors is None:
+            detectors = self.local.detectors = dict()
+
+        if confidence not in detectors:
+            detectors[confidence] = (
+                WARMUP.takeDetector(confidence) or
+                load_mediapipe().solutions.face_detection.FaceDetection(confidence)
+            )
+
+        with METRICS.timer("conversion"):
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+        return parse_detections(detectors[confidence].process(frame))
+
+    def takeBatch(self):
+        with self.condition:
+            while self.running:
+                batch = [(client, item) for client, item in self.pending.items() if client not in self.busy]
+                if batch:
+                    batch = batch[:max(1, -(-len(self.pending) // self.workers))]
+                    # Splits pending cameras between workers
+
+                    for client, _ in batch:
+                        del self.pending[client]
+                        self.busy.add(client)
+
+                    return batch
+
+                self.condition.wait(0.1)
+
+        return list()
+
+    def run(self):
+        while self.running:
+            batch = self.takeBatch()
+
+            for client, (frame, submitted_at) in batch:
+                try:
+                    with METRICS.timer("detection"):
+                        people, boxes = client.scheduler.process(frame)
+                    STARTUP.mark("first detection")
+
+                    client.result(people, boxes, submitted_at)
+                finally:
+                    with self.condition:
+                        self.busy.discard(client)
+                        self.condition.notify()
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+
+        with self.condition:
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.threads = list()
+
+class SessionEngine():
+    def __init__(self, imageProcessor, savePipeline, images_session=IMAGES_PER_SESSION, time_limit=3, burst_frames=5):
+        self.imageProcessor = imageProcessor
+        self.savePipeline = savePipeline
+
+        self.images_session = images_session
+        self.time_limit = time_limit
+        # Seconds to wait for capture
+        self.burst = deque(maxlen=max(1, burst_frames))
+        # Last frames before shutter, with live people count when each was offered
+
+        self.photos_taken = list()
+        self.framePool = None
+        self.session_buffers = None
+        # Preallocated frames of current session, taken from pool
+
+        self.cur_timer = 0
+        self.running = False
+        # From trigger until session is submitted for saving
+
+        self.frame = None
+        self.still = None
+        self.live_people = 0
+        # Latest count given by caller, not always detected on this frame
+        self.listeners = list()
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def notify(self, event, value):
+        for callback in list(self.listeners):
+            callback(event, value)
+        # Events are "countdown", "photo" and "session"
+
+    def configure(self, images_session, burst_frames):
+        self.images_session = images_session
+        self.burst = deque(maxlen=max(1, burst_frames))
+
+    def trigger(self):
+        if self.running:
+            return False
+            # Countdown already going, trigger is ignored
+
+        self.running = True
+        self.tick()
+
+        return True
+
+    def offerFrame(self, frame, live_people, still=None):
+        self.frame = frame
+        self.still = frame if still is None else still
+        self.live_people = live_people
+        # Headless kiosk detects on each burst frame, window passes
+        # latest asynchronous result, which may be a few frames old
+
+        if self.running and self.cur_timer == 1:
+            self.burst.append((frame, live_people, self.still))
+            # Frames are not reused by source, no copy is needed
+
+    def needsPeople(self):
+        return self.running and self.cur_timer <= 1
+        # Only burst and captured frames need a people count
+
+    def tick(self):
+        if self.cur_timer == 0:
+            self.cur_timer = self.time_limit
+        else:
+            self.cur_timer -= 1
+
+        if self.cur_timer <= 0 and self.frame is not None:
+            self.capture()
+
+        self.notify("countdown", self.cur_timer)
 
-    def parse_config_file(self):
-        with open(CONFIG_FILEPATH, "r") as file:
-            file_content = file.read()
-        
-        lines = file_content.split("\n")
-        for line in lines:
-            param, value = line.split(",")
-            self.config_dict[param] = value
+    def capture(self):
+        if not self.burst:
+            self.burst.append((self.frame, self.live_people, self.still))
 
-    def set(self, param, value):
-        self.config_dict[param] = value
+        frames, live_counts, stills = zip(*self.burst)
+        best = select_best_frame(frames, list(live_counts)) if len(frames) > 1 else 0
+        # Sharpness is compared on preview frames, full size one is kept
+        self.burst.clear()
 
-    def get(self, param):
-        if param in self.config_dict.keys():
-            value = self.config_dict[param]
-        else:
-            value = 0
-            # Its useful to set 0 to default values
+        buffer = self.sessionBuffer(stills[best].shape)
+        with METRICS.timer("conversion"):
+            cv2.cvtColor(stills[best], cv2.COLOR_BGR2RGB, dst=buffer)
+        # Only captured frames are converted to RGB, written in place on pool
 
-        return value
-    
-    def get_all(self):
-        return self.config_dict
+        self.photos_taken.append((buffer, live_counts[best]))
+        # Tuple of sharpest image and live people count when it was offered
+        self.notify("photo", len(self.photos_taken))
 
-    def save(self, config_dict=None):
-        if not config_dict:
-            config_dict = self.config_dict
+        if len(self.photos_taken) >= self.images_session:
+            self.submitSession()
 
-        file_content = ""
-        for key, value in config_dict.items():
-            file_content += f"{key},{value}\n"
+    def submitSession(self):
+        session_name = unique_session_name(self.imageProcessor.encoder.extension())
+        img_name = f"{MAIN_FOLDER}/{session_name}"
+        # Extension is set by output format
+        future = self.savePipeline.submit(self.photos_taken, img_name, f"{SESSIONS_FOLDER}/{session_name}")
+        # Saved on background, next session can start right away
+        future.add_done_callback(
+            lambda _, framePool=self.framePool, buffers=self.session_buffers: self.releaseSessionBuffers(framePool, buffers)
+        )
 
-        file_content = file_content[:-1]
-        # Deletes last \n to not generate other item on parsing
+        self.photos_taken = list()
+        self.session_buffers = None
+        self.running = False
 
-        with open(CONFIG_FILEPATH, "w") as file:
-            file.write(file_content)
+        self.notify("session", future)
 
-class ImageProcessor():
-    def __init__(self):
-        if not os.path.exists(MAIN_FOLDER):
-            os.makedirs(MAIN_FOLDER)
+    def reset(self):
+        if self.session_buffers is not None:
+            self.framePool.release(self.session_buffers)
+            self.session_buffers = None
+            # Photos of dropped session are never saved, buffers go back now
 
-        configActions = ConfigManager()
-        stamp_filepath = configActions.get("stamp_filepath")
-        filter_filepath = configActions.get("filter_filepath")
+        self.photos_taken = list()
+        self.burst.clear()
+        self.cur_timer = 0
+        self.running = False
+        # Next trigger starts a new countdown
+
+    def acquireSessionBuffers(self, shape):
+        if self.framePool is None or not self.framePool.fits(self.images_session, shape):
+            self.framePool = FramePool(self.images_session, shape)
+            # Sized from first captured frame, as camera may not honor resolution
+
+        return self.framePool.acquire()
+
+    def sessionBuffer(self, shape):
+        if self.session_buffers is None:
+            self.session_buffers = self.acquireSessionBuffers(shape)
+
+        index = len(self.photos_taken)
+        if index < len(self.session_buffers) and self.session_buffers.shape[1:] == shape:
+            return self.session_buffers[index]
+
+        return np.empty(shape, dtype=np.uint8)
+        # Session length or resolution changed while capturing
+
+    def releaseSessionBuffers(self, framePool, buffers):
+        framePool.release(buffers)
+        # Called from save worker once frames are not needed
+
+        peak = peak_rss_mb()
+        if peak is not None:
+            print(f"Peak RSS: {peak:.1f} MB, {framePool.allocations} session buffers allocated")
+
+class TriggerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode(errors="ignore").strip().lower()
+            reply = self.server.kiosk.command(command)
+            self.wfile.write(f"{reply}\n".encode())
+        # One command per line, as a hardware button script would send
+
+class HeadlessKiosk():
+    def __init__(self, source, port=None, fps=30):
+        configActions = get_config()
+
+        self.cap = configure_capture(open_frame_source(source, FREE_RUN), *still_resolution(source, fps), fps)
+        self.preview_width = configActions.get_int("preview_width", 640)
+        self.source = source
+        self.free_run = getattr(self.cap, "free_run", False)
+        self.frames_per_tick = max(1, round(self.cap.get(cv2.CAP_PROP_FPS) or fps))
+        # Free run counts down on source timeline, same frames are captured on every replay
+        self.frames = 0
+        self.session_time = 0.0
 
-        self.border_size = 10
-        self.stamp_filepath = stamp_filepath
-        self.filter_filepath = filter_filepath
+        self.imageProcessor = ImageProcessor()
+        self.savePipeline = SavePipeline(self.imageProcessor, open_files=False)
+        self.engine = SessionEngine(
+            self.imageProcessor,
+            self.savePipeline,
+            configActions.get_int("images_session", IMAGES_PER_SESSION),
+            burst_frames=configActions.get_int("burst_frames", 5)
+        )
+        self.engine.subscribe(self.sessionEvent)
 
-    def apply_filter(self, image):
-        filter_image = Image.open(self.filter_filepath)
-        filter_image = filter_image.resize(image.size)
-        image.paste(filter_image, (0, 0), filter_image)
+        self.face_detection_fn = load_mediapipe().solutions.face_detection.FaceDetection(
+            configActions.get_float("face_detection_coeff", 0.8)
+        )
+        self.face_detection_fn.process(np.zeros((128, 128, 3), dtype=np.uint8))
+        # Model is loaded before first trigger
+        self.scheduler = DetectionScheduler(
+            self.detect,
+            configActions.get_int("detection_interval", 5),
+            configActions.get_float("detection_scale", 0.5)
+        )
 
-        return image
+        self.commands = queue.Queue()
+        self.port = port
+        self.server = None
+        self.running = False
+
+    def detect(self, frame):
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return parse_detections(self.face_detection_fn.process(frame))
+
+    def command(self, command):
+        if command in ("", "trigger", "start"):
+            if self.engine.running:
+                return "busy"
+            self.commands.put("trigger")
+            return "ok"
+        if command == "status":
+            return json.dumps({
+                "running": self.engine.running,
+                "countdown": self.engine.cur_timer,
+                "photos": len(self.engine.photos_taken),
+                "saving": self.savePipeline.depth()
+            })
+        if command == "quit":
+            self.commands.put("quit")
+            return "ok"
+
+        return f"unknown command {command}"
+        # Called from stdin and socket threads, main loop runs actions
+
+    def readStdin(self):
+        for line in sys.stdin:
+            print(self.command(line.strip().lower()))
+        # Stops reading on EOF, kiosk keeps running on socket triggers
+
+    def serve(self):
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), TriggerHandler)
+        self.server.daemon_threads = True
+        self.server.kiosk = self
+        self.server.serve_forever()
+
+    def sessionEvent(self, event, value):
+        if event == "countdown":
+            print(f"Countdown {value}")
+        elif event == "photo":
+            print(f"Photo {value}/{self.engine.images_session}")
+        elif event == "session":
+            print(f"Session done, {self.savePipeline.depth()} saving")
+
+    def run(self):
+        threading.Thread(target=self.readStdin, daemon=True).start()
+        if self.port:
+            threading.Thread(target=self.serve, daemon=True).start()
+            print(f"Listening for triggers on 127.0.0.1:{self.port}")
+
+        print(f"Kiosk ready on {self.source}, send 'trigger' or an empty line to start")
+
+        self.running = True
+        next_tick = 0.0
+        tick_frames = 0
 
-    def append_horizontally(self, images, width, total_width, max_height):
-        new_im_x = Image.new('RGB', (total_width, max_height), (255, 255, 255))
+        try:
+            while self.running:
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    command = None
+
+                if command == "quit":
+                    break
+                if command == "trigger" and self.engine.trigger():
+                    next_tick = time.monotonic() + 1
+                    tick_frames = 0
+
+                if not self.engine.running:
+                    if self.free_run or not self.cap.grab():
+                        time.sleep(0.01)
+                    continue
+                    # Idle, keeps camera buffer fresh without decoding frames,
+                    # replay stays where it is so sessions see same frames
+
+                frame_start = time.monotonic()
+                ret, frame = self.cap.read()
+                if not ret:
+                    time.sleep(0.01)
+                    continue
+                self.frames += 1
+
+                if self.engine.needsPeople():
+                    preview = preview_frame(frame, self.preview_width)
+                    people = self.scheduler.process(preview)[0]
+                    # Detection runs only for frames that may be captured
+                else:
+                    preview, people = frame, 0
+                self.engine.offerFrame(preview, people, frame)
+
+                tick_frames += 1
+                if (tick_frames >= self.frames_per_tick) if self.free_run else (time.monotonic() >= next_tick):
+                    self.engine.tick()
+                    next_tick += 1
+                    tick_frames = 0
+
+                self.session_time += time.monotonic() - frame_start
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(f"Processed {self.frames} frames in {self.session_time:.2f}s of sessions ({self.frames / max(self.session_time, 1e-6):.1f} frames/s)")
+            self.stop()
 
-        x_offset = 0
-        for im in images:
-            new_im_x.paste(im, (x_offset, self.border_size))
-            x_offset += width + self.border_size
+    def stop(self):
+        self.running = False
 
-        return new_im_x
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
 
-    def append_vertically(self, image, total_width, max_height, faces):
-        total_height = max_height * faces + self.border_size * (faces - 1)
-        new_im_y = Image.new('RGB', (total_width, total_height), (255, 255, 255))
+        self.savePipeline.shutdown(wait=True)
+        # Sessions already taken are saved before exiting
+        self.cap.release()
+        self.face_detection_fn.close()
 
-        y_offset = 0
-        for _ in range(faces):
-            new_im_y.paste(image, (self.border_size, y_offset))
-            y_offset += max_height + self.border_size
+class PreviewWidget(QWidget):
+    def __init__(self):
+        super().__init__()
 
-        return new_im_y
+        self.image = None
+        self.buffer = None
 
-    def save(self, images_list, filename):
-        images = list()
-        faces = list()
+        self.setMinimumSize(320, 240)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        # Whole widget is painted on every paintEvent
 
-        for item in images_list:
-            image, face = item
-            image = Image.fromarray(image)
+    def setFrame(self, frame):
+        if not frame.flags["C_CONTIGUOUS"]:
+            frame = np.ascontiguousarray(frame)
 
-            if len(self.filter_filepath) and os.path.exists(self.filter_filepath):
-                image = self.apply_filter(image)
-                # Applies filter
-            else:
-                print("Filter filepath not exists or not assigned")
+        resized = self.image is None or self.image.width() != frame.shape[1] or self.image.height() != frame.shape[0]
 
-            images.append(image)
-            faces.append(face)
+        self.buffer = frame
+        # QImage wraps buffer without copying, so it must be kept alive
+        self.image = QtGui.QImage(
+            self.buffer.data,
+            self.buffer.shape[1],
+            self.buffer.shape[0],
+            self.buffer.strides[0],
+            QtGui.QImage.Format_BGR888
+        )
+        # OpenCV BGR order is drawn as is, without converting colors
 
-        faces = max(set(faces), key=faces.count) or 1
-        # Gets most common case on faces list, minimum 1
+        if resized:
+            self.updateGeometry()
 
-        images_size = images[0].size
-        width, height = images_size
+        self.update()
+        # Schedules paintEvent, several frames between paints are merged
 
-        if len(self.stamp_filepath) and os.path.exists(self.stamp_filepath):
-            stamp_image = Image.open(open(self.stamp_filepath, "rb"))
-            stamp_image = stamp_image.resize((stamp_image.size[0], images_size[1]))
-            images.insert(0, stamp_image)
-        # Adds stamp resized to common images size
+    def sizeHint(self):
+        if self.image is None:
+            return QtCore.QSize(640, 480)
 
-        total_width = width * len(images) + self.border_size * len(images)
-        max_height = height + self.border_size * 2
+        return self.image.size()
 
-        new_im_x = self.append_horizontally(images, width, total_width, max_height)
+    def paintEvent(self, event):
+        with METRICS.timer("display"):
+            self.paint()
 
-        new_im_y = self.append_vertically(new_im_x, total_width, max_height, faces)
+    def paint(self):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
 
-        new_im_y.save(filename)
-        os.system(f"start {filename}")
-        # Open photo in file system
+        if self.image is not None:
+            target = QtCore.QRect(QtCore.QPoint(0, 0), self.image.size().scaled(self.size(), Qt.KeepAspectRatio))
+            target.moveCenter(self.rect().center())
+            painter.drawImage(target, self.image)
+            # Scaled once while drawing to widget
+
+        painter.end()
 
 class QtCapture(QWidget):
-    def __init__(self, *args, fps=30, width=840, height=680):
+    def __init__(self, *args, fps=30, width=None, height=None, detectionPool=None):
         super(QWidget, self).__init__()
 
         if len(args) == 0:
-            configActions = ConfigManager()
-            capture_index = int(configActions.get("camera_index"))
-
-            args = (capture_index,)
+            args = (configured_source(),)
+            # Camera index from config, or replay source from arguments
 
-        self.cap = cv2.VideoCapture(*args)
+        self.capture_args = args
 
         self.fps = fps
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        if width is None or height is None:
+            width, height = still_resolution(args[0], fps)
+        self.width = width
+        self.height = height
+        # Stream runs at still size, preview is downscaled from it
+
+        self.cap = self.configureCapture(WARMUP.takeCapture(args) or open_frame_source(args[0], FREE_RUN))
+        # Camera opened on background at start, if it is same one
 
         self.frame = None
+        self.still = None
+        self.frame_id = 0
+        self.read_id = 0
+        # Last frame taken from grabber, shown or skipped by pacer
         self.close_callback = None
 
-        self.face_detection_coeff = 0.8
-        self.face_detection_fn = mp.solutions.face_detection.FaceDetection(self.face_detection_coeff)
+        self.grabber = FrameGrabber(self.cap, self.fps, get_config().get_int("preview_width", 640))
+        self.grabber.frameReady.connect(self.frameReadySlot)
+        self.pacer = FramePacer(self.fps)
+        # Preview follows camera delivery instead of a fixed timer
+
+        configActions = get_config()
+        self.face_detection_coeff = configActions.get_float("face_detection_coeff", 0.8)
+        # Calibrated value, or default one
+        self.detection_enabled = False
+        # Subclasses which need people count enable it
+        self.live_filter_filepath = self.liveFilterFilepath()
+        # Guests see filter while posing, as it will be saved
+
+        self.people_on_image = 0
+        self.face_boxes = list()
+
+        detection_args = (
+            self.face_detection_coeff,
+            configActions.get_int("detection_interval", 5),
+            configActions.get_float("detection_scale", 0.5)
+        )
+        if detectionPool:
+            self.detector = detectionPool.client(f"Camera {args[0]}", *detection_args)
+            # Several cameras share pool threads and detectors
+        else:
+            self.detector = DetectionWorker(*detection_args)
+        self.detector.detected.connect(self.detectionSlot)
+
+        configActions.subscribe(self.configChanged)
+        # Pushed on every config change, instead of reading file again
 
         self.initUI()
 
@@ -202,54 +2686,160 @@ class QtCapture(QWidget):
         self.lay = QGridLayout()
         self.setLayout(self.lay)
 
-        self.video_frame = QLabel()
+        self.video_frame = PreviewWidget()
         self.lay.addWidget(self.video_frame, 1, 1)
 
+        self.metrics_label = None
+        if METRICS.enabled:
+            self.metrics_label = QLabel(self.video_frame)
+            self.metrics_label.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+            self.metrics_label.move(8, 8)
+            # Debug overlay drawn over preview
+
+            self.metrics_timer = QtCore.QTimer()
+            self.metrics_timer.timeout.connect(self.updateMetricsSlot)
+
+    def configureCapture(self, cap):
+        return configure_capture(cap, self.width, self.height, self.fps)
+
+    def setCapture(self, cap):
+        old_cap = self.cap
+
+        self.cap = self.configureCapture(cap)
+        self.grabber.setCapture(self.cap)
+        # Grabber thread is stopped before swapping
+
+        old_cap.release()
+
     def setFPS(self, fps):
         self.fps = fps
         self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+        self.grabber.setFPS(self.fps)
+        self.pacer.setFPS(self.fps)
+
+    def getFPSReport(self):
+        return {
+            "requested": self.fps,
+            "camera": self.grabber.cameraFPS(),
+            "achieved": self.pacer.achievedFPS()
+        }
 
     def getPeopleOnImage(self, frame):
-        result = self.face_detection_fn.process(frame)
+        people, _ = self.detector.detect(frame)
+        # Synchronous on a BGR frame, live stream uses detectionSlot instead
 
-        if not result or (result and not result.detections):
-            result = 0
-        else:
-            result = len(result.detections)
+        return people
 
-        return result
+    def detectionSlot(self, people, boxes):
+        self.people_on_image = people
+        self.face_boxes = boxes
 
     def showFrame(self, frame):
-        img = QtGui.QImage(
-            self.frame,
-            self.frame.shape[1],
-            self.frame.shape[0],
-            QtGui.QImage.Format_RGB888
-        )
-        pix = QtGui.QPixmap.fromImage(img)
-        self.video_frame.setPixmap(pix)
+        if self.live_filter_filepath:
+            height, width = frame.shape[:2]
+
+            try:
+                with METRICS.timer("overlay"):
+                    frame = OVERLAY_CACHE.alpha(self.live_filter_filepath, (width, height), bgr=True).apply(frame)
+                    # On a copy, detection and stills get frame without filter
+            except OSError as e:
+                print(f"Error loading live filter: {e}")
+                self.live_filter_filepath = ""
+
+        self.video_frame.setFrame(frame)
+
+    def frameReadySlot(self):
+        now = time.monotonic()
+        camera_interval = self.grabber.cameraInterval()
+
+        if not self.grabber.free_run and not self.pacer.shouldShow(now, camera_interval):
+            self.read_id = self.grabber.read()[0]
+            # Acknowledged, so grabber notifies next frame
+            METRICS.count("paced_frames")
+            return
+
+        self.nextFrameSlot()
+        self.pacer.frameShown(now, time.monotonic() - self.grabber.lastFrameTime(), camera_interval)
 
     def nextFrameSlot(self):
-        _, frame = self.cap.read()
-        # OpenCV yields frames in BGR format
-        try:
-            self.frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        except cv2.error:
-            self.frame = None
-            return # cv2.cvtColor receive not initialized frame
+        frame_id, frame, still = self.grabber.readWithStill()
+        # Newest frame read by grabber thread, in BGR format
+
+        if frame is None or frame_id == self.frame_id:
+            return # No new frame since last call
+
+        if self.read_id:
+            METRICS.count("dropped_frames", max(0, frame_id - self.read_id - 1))
+            # Frames overwritten on grabber before being read, paced ones are counted apart
+        METRICS.count("frames")
+
+        self.read_id = frame_id
+        self.frame_id = frame_id
+        self.frame = frame
+        self.still = still
 
         self.showFrame(self.frame)
+        STARTUP.mark("first frame")
+
+        if self.detection_enabled:
+            self.detector.submit(self.frame)
+            # Worker drops it if a newer frame arrives first
+
+    def updateMetricsSlot(self):
+        dropped = METRICS.summary()["counters"].get("dropped_frames", 0)
+        report = self.getFPSReport()
+
+        self.metrics_label.setText(
+            f"FPS {report['achieved']:.1f}/{report['requested']} (camera {report['camera']:.1f})\n"
+            f"Dropped frames {dropped}\n"
+            f"Grab {METRICS.mean_ms('grab'):.1f} ms, retrieve {METRICS.mean_ms('retrieve'):.1f} ms\n"
+            f"Detection latency {METRICS.mean_ms('detection_latency'):.1f} ms "
+            f"(processing {METRICS.mean_ms('detection'):.1f} ms)"
+        )
+        self.metrics_label.adjustSize()
 
     def start(self):
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.nextFrameSlot)
-        self.timer.start(math.ceil(1000.0 / self.fps))
-        # Rounded to closest integer up calculated value
+        self.grabber.start()
+
+        if self.metrics_label:
+            self.metrics_timer.start(1000)
+
+        if self.detection_enabled:
+            self.detector.start()
 
     def stop(self):
-        self.timer.stop()
+        if self.metrics_label:
+            self.metrics_timer.stop()
+
+        if self.grabber.running:
+            report = self.getFPSReport()
+            print(f"Preview {report['achieved']:.1f}/{report['requested']} FPS, camera {report['camera']:.1f} FPS")
+
+        self.grabber.stop()
+        self.detector.stop()
+
+    def liveFilterFilepath(self):
+        configActions = get_config()
+        filepath = configActions.get("filter_filepath") or ""
+
+        if not configActions.get_int("live_filter", 1) or not os.path.exists(filepath):
+            return ""
+
+        return filepath
+
+    def configChanged(self, config):
+        configActions = get_config()
+        self.face_detection_coeff = configActions.get_float("face_detection_coeff", 0.8)
+        self.live_filter_filepath = self.liveFilterFilepath()
+        self.detector.setConfidence(self.face_detection_coeff)
+        self.detector.setSchedule(
+            configActions.get_int("detection_interval", 5),
+            configActions.get_float("detection_scale", 0.5)
+        )
 
     def deleteLater(self):
+        self.stop()
+        get_config().unsubscribe(self.configChanged)
         self.cap.release()
         super(QWidget, self).deleteLater()
 
@@ -257,12 +2847,16 @@ class QtCapture(QWidget):
         self.close_callback = callback
 
     def closeEvent(self, event):
+        self.stop()
+        get_config().unsubscribe(self.configChanged)
+        # Grabber thread would keep reading camera otherwise
+
         if self.close_callback:
             self.close_callback()
         event.accept()
 
 class QtSaveContentCapture(QtCapture):
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         self.phrases_list = [
             "Press SPACE to start...",
             "Another photo?",
@@ -272,18 +2866,27 @@ class QtSaveContentCapture(QtCapture):
         # Needs to be before because initUI uses it
         # and it is called in QtCapture.__init__
 
-        super().__init__(*args)
-
-        self.IMAGES_SESSION = IMAGES_PER_SESSION
-        self.TIME_LIMIT = 3
-        # Seconds to wait for capture
+        super().__init__(*args, **kwargs)
 
-        self.photos_taken = list()
-        self.prev = 0
-        self.cur_timer = 0
-        self.timer_working = False
+        self.detection_enabled = True
 
         self.imageProcessor = ImageProcessor()
+        self.savePipeline = SavePipeline(self.imageProcessor)
+        self.savePipeline.saved.connect(self.savedSlot)
+        self.savePipeline.failed.connect(self.savedSlot)
+
+        configActions = get_config()
+        self.engine = SessionEngine(
+            self.imageProcessor,
+            self.savePipeline,
+            configActions.get_int("images_session", IMAGES_PER_SESSION),
+            burst_frames=configActions.get_int("burst_frames", 5)
+        )
+        self.engine.subscribe(self.sessionEvent)
+        # Session state lives on engine, widget only shows it
+
+        self.timer_timer = QtCore.QTimer()
+        self.timer_timer.timeout.connect(self.engine.tick)
 
         self.setWindowTitle('Capture Window')
 
@@ -298,59 +2901,89 @@ class QtSaveContentCapture(QtCapture):
 
         self.timer_label = self.addLabel("-", 40)
         self.bottom_label = self.addLabel(self.phrases_list[0], 10)
+        self.save_label = self.addLabel("", 10)
 
         self.lay.addWidget(self.timer_label, 1, 0, alignment=Qt.AlignTop)
         self.lay.addWidget(self.bottom_label, 2, 1)
+        self.lay.addWidget(self.save_label, 3, 1)
 
-    def update_timer(self):
-        if self.cur_timer == 0:
-            self.cur_timer = self.TIME_LIMIT
-        else:
-            self.cur_timer -= 1
-
-        if self.cur_timer <= 0:
-            if self.frame is not None:
-                self.photos_taken.append(
-                    (
-                        copy.copy(self.frame),
-                        self.getPeopleOnImage(self.frame)
-                    )
-                )
-                # Tuple of image and number of faces detected on it
-
-                self.bottom_label.setText(self.phrases_list[len(self.photos_taken)])
-                # Changes bottom label text depending on number of photon taken
+    def getPhrase(self, photos_taken):
+        if photos_taken == self.engine.images_session:
+            return self.phrases_list[3]
+        elif photos_taken == self.engine.images_session - 1:
+            return self.phrases_list[2]
+        elif photos_taken > 0:
+            return self.phrases_list[1]
 
-                if len(self.photos_taken) == self.IMAGES_SESSION:
-                    datetime_string = datetime.now().strftime("%H-%M-%S")
-                    img_name = f"{MAIN_FOLDER}/{datetime_string}.png"
-                    self.imageProcessor.save(self.photos_taken, img_name)
+        return self.phrases_list[0]
+        # Phrases follow session length set on config
 
-                    self.photos_taken = list()
-                    self.timer_timer.stop()
+    def configChanged(self, config):
+        super().configChanged(config)
 
-        self.timer_label.setText(str(self.cur_timer))
+        self.engine.configure(
+            get_config().get_int("images_session", IMAGES_PER_SESSION),
+            get_config().get_int("burst_frames", 5)
+        )
+        self.imageProcessor.stamp_filepath = config.get("stamp_filepath", "")
+        self.imageProcessor.filter_filepath = config.get("filter_filepath", "")
+        self.imageProcessor.encoder = StripEncoder()
+
+    def updateSaveLabel(self):
+        pending = self.savePipeline.depth()
+        self.save_label.setText(f"Saving {pending} photo(s)..." if pending else "")
+
+    def savedSlot(self, filename, _):
+        self.updateSaveLabel()
+
+    def sessionEvent(self, event, value):
+        if event == "countdown":
+            self.timer_label.setText(str(value))
+        elif event == "photo":
+            self.bottom_label.setText(self.getPhrase(value))
+            # Changes bottom label text depending on number of photon taken
+        elif event == "session":
+            self.timer_timer.stop()
+            self.updateSaveLabel()
 
     def nextFrameSlot(self):
+        frame_id = self.frame_id
         super().nextFrameSlot()
 
+        if self.frame_id != frame_id:
+            self.engine.offerFrame(self.frame, self.people_on_image, self.still)
+            # Grabber yields a new array per frame, no copy is needed
+
+    def stop(self):
+        self.timer_timer.stop()
+        # Ticking after deleteLater would update labels already deleted
+        self.engine.reset()
+        # Session in progress is dropped, it would be captured from a frozen frame
+        super().stop()
+
+    def deleteLater(self):
+        self.savePipeline.shutdown()
+        super().deleteLater()
+
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Space:
-            if not self.timer_working:
-                self.timer_timer = QtCore.QTimer()
-                self.timer_timer.timeout.connect(self.update_timer)
+            if self.engine.trigger():
                 self.timer_timer.start(1000)
 
-                self.update_timer()
-
 class QtCalibrationCapture(QtCapture):
     def __init__(self, *args):
         super().__init__(*args)
 
-        self.face_detection_comparisons = 0
-        self.FACE_DETECTION_COMPARISONS_LIMIT = self.fps * 10
-        # 10 frames to calibrate
+        self.detection_enabled = True
+
+        self.live_filter_filepath = ""
+        # Boxes are drawn on plain frame
+        self.detector.setConfidence(CALIBRATION_MIN_CONFIDENCE)
+        self.detector.setSchedule(1, 1.0)
+        # Single detection instance reporting every candidate score,
+        # on every preview frame, downscaled to preview_width, not on stills
 
+        self.calibrationEngine = None
         self.calibrating = False
 
     def addButton(self, text, callback=None):
@@ -382,69 +3015,71 @@ class QtCalibrationCapture(QtCapture):
     def startCalibration(self):
         self.people = int(self.peopleLineEdit.text())
         if self.people != 0:
+            self.setCalibrateParam(self.people)
             self.calibrating = True
             self.bottom_label.setText("Calibrating... Please wait")
 
     def setCalibrateParam(self, people):
         self.people = people
-        self.face_detection_comparisons = 0
+        self.calibrationEngine = CalibrationEngine(people)
 
-    def getPeopleOnImage(self, frame):
-        results = self.face_detection_fn.process(frame)
-        mp_drawing = mp.solutions.drawing_utils
-
-        if not results.detections:
-          return None, 0
-
-        for detection in results.detections:
-            mp_drawing.draw_detection(frame, detection)
-            # Draws rectangles for each detection
-
-        return frame, len(results.detections)
-
-    def tuneFaceDetectionParam(self, people, people_on_image):
-        if self.people > people_on_image:
-            self.face_detection_coeff *= 0.9
-        elif self.people < people_on_image:
-            self.face_detection_coeff *= 1.1
-
-        return self.face_detection_coeff
+    def showFrame(self, frame):
+        if self.calibrating and self.face_boxes:
+            frame = frame.copy()
+            # Grabber frame is shared, draws on a copy
+            height, width = frame.shape[:2]
 
-    def compareToCalibrate(self, frame):
-        self.face_detection_comparisons += 1
+            for xmin, ymin, box_width, box_height, _ in self.face_boxes:
+                top_left = (int(xmin * width), int(ymin * height))
+                bottom_right = (int((xmin + box_width) * width), int((ymin + box_height) * height))
+                cv2.rectangle(frame, top_left, bottom_right, (255, 255, 255), 2)
+                # Draws rectangles for each detection
 
-        if self.face_detection_comparisons > self.FACE_DETECTION_COMPARISONS_LIMIT:
-            configActions = ConfigManager()
-            configActions.set("face_detection_coeff", str(self.face_detection_coeff))
-            configActions.save()
+        super().showFrame(frame)
 
-            self.close()
+    def configChanged(self, config):
+        pass
+        # Keeps minimum confidence while calibrating
 
-        frame, people_on_image = self.getPeopleOnImage(frame)
+    def compareToCalibrate(self, boxes):
+        self.calibrationEngine.add(boxes)
 
-        if frame is None or people_on_image == 0:
+        if not self.calibrationEngine.done():
             return
 
-        super().showFrame(frame)
+        self.face_detection_coeff = self.calibrationEngine.result()
+        print(f"Calibrated face detection coeff: {self.face_detection_coeff:.3f}")
 
-        self.face_detection_coeff = self.tuneFaceDetectionParam(self.people, people_on_image)
+        configActions = get_config()
+        configActions.set("face_detection_coeff", str(self.face_detection_coeff))
+        configActions.save()
 
-        self.face_detection_fn = mp.solutions.face_detection.FaceDetection(self.face_detection_coeff)
-        # Updates face detection coeffs
+        self.calibrating = False
+        self.close()
 
-    def nextFrameSlot(self):
-        super().nextFrameSlot()
+    def detectionSlot(self, people, boxes):
+        super().detectionSlot(people, boxes)
 
-        if self.calibrating and self.frame is not None:
-            self.compareToCalibrate(self.frame)
+        if self.calibrating:
+            self.compareToCalibrate(boxes)
 
 class QtSelectCameraCapture(QtCapture):
+    camerasProbed = QtCore.pyqtSignal()
+    # Queued from probing thread
+
     def __init__(self, *args):
         super().__init__(*args)
 
-        self.current_camera = 0
-        self.LIMIT_SEARCH = 10
-        # Camera index to stop searching
+        self.current_camera = self.capture_args[0]
+        self.switchable = isinstance(self.current_camera, int) or str(self.current_camera).isdigit()
+        # Replay sources are not cameras, there is nothing to switch to
+        if self.switchable:
+            self.current_camera = int(self.current_camera)
+
+        self.camerasProbed.connect(self.camerasProbedSlot)
+        CAMERA_INVENTORY.subscribe(self.camerasProbedCallback)
+        self.change_camera_button.setEnabled(self.switchable and not CAMERA_INVENTORY.isProbing())
+        # Enabled again when startup probing ends
 
     def addButton(self, text, callback=None):
         button = QPushButton(text)
@@ -465,29 +3100,329 @@ class QtSelectCameraCapture(QtCapture):
         self.lay.addWidget(self.save_and_exit_button, 3, 1)
 
     def next_camera(self):
-        is_working = False
-        while not is_working and self.current_camera <= 10:
-            self.cap = cv2.VideoCapture(self.current_camera)
-            if self.cap.isOpened():
-                is_working = True
-            self.current_camera += 1
+        if not self.switchable or CAMERA_INVENTORY.isProbing():
+            return
+
+        index = CAMERA_INVENTORY.next_index(self.current_camera)
+        if index is None:
+            self.probeCameras()
+            return
+            # Nothing probed yet, next press uses new inventory
+
+        if index == self.current_camera:
+            return
+
+        cap = cv2.VideoCapture(index)
+        if not cap.isOpened():
+            cap.release()
+            self.probeCameras()
+            return
+            # Camera unplugged since it was probed, inventory is refreshed
 
-        if self.current_camera >= 10:
-            self.current_camera = 0
+        self.current_camera = index
+        self.setCapture(cap)
+
+    def probeCameras(self):
+        self.change_camera_button.setEnabled(False)
+        CAMERA_INVENTORY.probe_async(busy=(self.current_camera,))
+        # On background, camera shown keeps its entry as it is held open
+
+    def camerasProbedCallback(self):
+        self.camerasProbed.emit()
+        # Bound method, so it can be unsubscribed
+
+    def camerasProbedSlot(self):
+        self.change_camera_button.setEnabled(self.switchable)
+
+    def stop(self):
+        CAMERA_INVENTORY.unsubscribe(self.camerasProbedCallback)
+        super().stop()
 
     def save_and_exit(self):
-        configActions = ConfigManager()
-        configActions.set("camera_index", str(self.current_camera))
-        configActions.save()
+        if self.switchable:
+            configActions = get_config()
+            configActions.set("camera_index", str(self.current_camera))
+            configActions.save()
 
         self.close()
 
+class MultiCaptureWindow(QWidget):
+    def __init__(self, camera_indexes, workers=2):
+        QWidget.__init__(self)
+
+        self.detectionPool = DetectionPool(workers)
+        # One pool for all cameras, detection CPU does not grow with each one
+        self.captures = [QtSaveContentCapture(index, detectionPool=self.detectionPool) for index in camera_indexes]
+
+        self.cpu_time = time.process_time()
+        self.wall_time = time.monotonic()
+
+        self.setWindowTitle('Multi Camera')
+        self.initUI()
+
+        self.report_timer = QtCore.QTimer()
+        self.report_timer.timeout.connect(self.updateReportSlot)
+
+    def initUI(self):
+        gbox = QGridLayout(self)
+        self.setLayout(gbox)
+
+        columns = 2 if len(self.captures) > 1 else 1
+        for position, capture in enumerate(self.captures):
+            gbox.addWidget(capture, position // columns, position % columns)
+
+        self.report_label = QLabel("")
+        self.report_label.setFont(QtGui.QFont('Arial', 10))
+        gbox.addWidget(self.report_label, (len(self.captures) + columns - 1) // columns, 0, 1, columns)
+
+    def getReport(self):
+        now_cpu = time.process_time()
+        now_wall = time.monotonic()
+        cpu = (now_cpu - self.cpu_time) / max(now_wall - self.wall_time, 1e-6)
+        self.cpu_time, self.wall_time = now_cpu, now_wall
+
+        cameras = list()
+        for capture in self.captures:
+            report = capture.detector.report()
+            report.update(capture.getFPSReport())
+            report["camera"] = capture.capture_args[0]
+            cameras.append(report)
+
+        return {"cpu_percent": cpu * 100, "cameras": cameras}
+
+    def updateReportSlot(self):
+        report = self.getReport()
+
+        lines = [
+            f"Camera {camera['camera']}: {camera['achieved']:.1f} FPS, "
+            f"detection {camera['detections_per_s']:.1f}/s, {camera['latency_ms']:.0f} ms latency, {camera['dropped']} dropped"
+            for camera in report["cameras"]
+        ]
+        lines.append(f"CPU {report['cpu_percent']:.0f}% for {len(self.captures)} cameras")
+
+        self.report_label.setText("\n".join(lines))
+
+    def start(self):
+        self.detectionPool.start()
+
+        for capture in self.captures:
+            capture.start()
+
+        self.report_timer.start(1000)
+
+    def stop(self):
+        self.report_timer.stop()
+
+        for capture in self.captures:
+            capture.close()
+            # Stops grabber and detection client of each camera
+
+        for camera in self.getReport()["cameras"]:
+            print(f"Camera {camera['camera']}: detection {camera['detections_per_s']:.1f}/s, {camera['latency_ms']:.0f} ms latency")
+
+        self.detectionPool.stop()
+
+    def keyPressEvent(self, event):
+        for capture in self.captures:
+            capture.keyPressEvent(event)
+        # One trigger starts session on every camera
+
+    def closeEvent(self, event):
+        self.stop()
+
+        for capture in self.captures:
+            capture.deleteLater()
+        event.accept()
+
+class StripListModel(QtCore.QAbstractListModel):
+    thumbnailReady = QtCore.pyqtSignal(str, QtGui.QImage)
+    # Strip path and its thumbnail, loaded on background
+    stripsAdded = QtCore.pyqtSignal(list)
+    # Paths indexed by background scan
+    totalChanged = QtCore.pyqtSignal(int)
+
+    def __init__(self, stripIndex, page_size=GALLERY_PAGE_SIZE):
+        super().__init__()
+
+        self.stripIndex = stripIndex
+        self.page_size = page_size
+        self.rows = list()
+        self.row_of = dict()
+        # Strip path to row, for thumbnails loaded later
+        self.total = stripIndex.count()
+
+        self.thumbnails = dict()
+        # Strip path to icon, only for loaded ones
+        self.requested = set()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.cancelled = threading.Event()
+
+        placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        placeholder.fill(QtCore.Qt.lightGray)
+        self.placeholder = QtGui.QIcon(placeholder)
+
+        self.thumbnailReady.connect(self.thumbnailSlot)
+        self.stripsAdded.connect(self.stripsAddedSlot)
+
+    def scan(self, folder):
+        self.executor.submit(self.stripIndex.scan, folder, self.stripsAdded.emit, self.cancelled)
+        # Large folders take a while, strips show up as they are indexed
+
+    def stripsAddedSlot(self, filepaths):
+        loaded_all = len(self.rows) >= self.total
+        self.total = self.stripIndex.count()
+
+        for row in sorted(self.stripIndex.rows(filepaths), key=lambda row: (row[2], row[1]), reverse=True):
+            if row[1] in self.row_of:
+                continue
+
+            key = (row[2], row[1])
+            position = next((i for i, loaded in enumerate(self.rows) if (loaded[2], loaded[1]) < key), len(self.rows))
+            if position == len(self.rows) and not loaded_all:
+                continue
+                # Past loaded pages, fetched on scrolling
+
+            self.beginInsertRows(QtCore.QModelIndex(), position, position)
+            self.rows.insert(position, row)
+            self.endInsertRows()
+            # Loaded rows stay first ones by page order, so offsets hold
+
+        self.row_of = {row[1]: i for i, row in enumerate(self.rows)}
+        self.totalChanged.emit(self.total)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and len(self.rows) < self.total
+
+    def fetchMore(self, parent):
+        rows = self.stripIndex.page(len(self.rows), self.page_size)
+        if not rows:
+            self.total = len(self.rows)
+            return
+
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        for row in rows:
+            self.row_of[row[1]] = len(self.rows)
+            self.rows.append(row)
+        self.endInsertRows()
+        # Only pages scrolled to are read from index
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        _, filepath, timestamp, faces, width, height, size, _ = self.rows[index.row()]
+
+        if role == QtCore.Qt.DisplayRole:
+            return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        if role == QtCore.Qt.DecorationRole:
+            if filepath not in self.thumbnails:
+                self.requestThumbnail(filepath)
+                return self.placeholder
+            return self.thumbnails[filepath]
+        if role == QtCore.Qt.ToolTipRole:
+            return f"{os.path.basename(filepath)}\n{width}x{height}, {size // 1024} KB, {faces or '?'} faces"
+        if role == QtCore.Qt.UserRole:
+            return filepath
+
+        return None
+
+    def requestThumbnail(self, filepath):
+        if filepath in self.requested:
+            return
+        self.requested.add(filepath)
+
+        self.executor.submit(self.loadThumbnail, filepath)
+        # Decoding strips would block gallery scrolling
+
+    def loadThumbnail(self, filepath):
+        try:
+            image = QtGui.QImage(self.stripIndex.thumbnail(filepath))
+        except OSError as e:
+            print(f"Error loading thumbnail of {filepath}: {e}")
+            return
+
+        self.thumbnailReady.emit(filepath, image)
+        # QImage can be made on any thread, pixmap only on GUI one
+
+    def thumbnailSlot(self, filepath, image):
+        self.thumbnails[filepath] = QtGui.QIcon(QPixmap.fromImage(image))
+
+        if filepath in self.row_of:
+            index = self.index(self.row_of[filepath])
+            self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def shutdown(self):
+        self.cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class GalleryWindow(QWidget):
+    def __init__(self):
+        QWidget.__init__(self)
+
+        self.model = StripListModel(get_strip_index())
+
+        self.setWindowTitle('Gallery')
+        self.initUI()
+        self.resize(1000, 700)
+
+        if os.path.exists(MAIN_FOLDER):
+            self.model.scan(MAIN_FOLDER)
+            # Adds strips saved before index, or copied into folder, on background
+
+    def addButton(self, text, callback=None):
+        button = QPushButton(text)
+        button.setFont(QtGui.QFont('Arial', 15))
+
+        if callback:
+            button.clicked.connect(callback)
+
+        return button
+
+    def initUI(self):
+        self.list_view = QListView()
+        self.list_view.setViewMode(QListView.IconMode)
+        self.list_view.setResizeMode(QListView.Adjust)
+        self.list_view.setIconSize(QtCore.QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setMovement(QListView.Static)
+        self.list_view.setModel(self.model)
+        self.list_view.doubleClicked.connect(self.openStrip)
+
+        self.count_label = QLabel(f"{self.model.total} strips")
+        self.model.totalChanged.connect(self.updateCountSlot)
+        self.open_folder_button = self.addButton("Open Folder", self.openFolder)
+
+        vbox = QVBoxLayout(self)
+        self.setLayout(vbox)
+
+        vbox.addWidget(self.count_label)
+        vbox.addWidget(self.list_view)
+        vbox.addWidget(self.open_folder_button)
+
+    def updateCountSlot(self, total):
+        self.count_label.setText(f"{total} strips")
+
+    def openStrip(self, index):
+        open_path(self.model.data(index, QtCore.Qt.UserRole))
+
+    def openFolder(self):
+        open_path(MAIN_FOLDER)
+
+    def closeEvent(self, event):
+        self.model.shutdown()
+        super().closeEvent(event)
+
 class ConfigWindow(QWidget):
     def __init__(self):
         QWidget.__init__(self)
 
-        configActions = ConfigManager()
+        configActions = get_config()
         self.all_config = configActions.get_all()
+        self.opened_config = dict(self.all_config)
+        # Only keys changed from these values are written back
 
         self.label_font_size = 11
 
@@ -536,6 +3471,24 @@ class ConfigWindow(QWidget):
         self.filter_filepath_label = self.addLabel(self.all_config["filter_filepath"] or "Filter file path", self.label_font_size)
         filter_filepath_change_button = self.addButton("Change dir", self.change_dir_filter)
         filter_filepath_clear_button = self.addButton("Clear Filter", self.clear_filter)
+        self.live_filter_check = QCheckBox("Show on preview")
+        self.live_filter_check.setChecked(self.all_config.get("live_filter", "1") == "1")
+
+        output_format_label = self.addLabel("Output format", self.label_font_size)
+        self.output_format_combo = QComboBox()
+        self.output_format_combo.addItems(list(OUTPUT_FORMATS))
+        self.output_format_combo.setCurrentText(self.all_config.get("output_format", "png"))
+        self.output_progressive_check = QCheckBox("Progressive (JPEG)")
+        self.output_progressive_check.setChecked(self.all_config.get("output_progressive", "0") == "1")
+
+        output_quality_label = self.addLabel("Quality (JPEG/WebP)", self.label_font_size)
+        self.output_quality_entry = self.addLineEdit(self.all_config.get("output_quality", "90"))
+
+        png_compress_level_label = self.addLabel("PNG compress level (0-9)", self.label_font_size)
+        self.png_compress_level_entry = self.addLineEdit(self.all_config.get("png_compress_level", "6"))
+
+        web_copy_width_label = self.addLabel("Web copy width (0 disables)", self.label_font_size)
+        self.web_copy_width_entry = self.addLineEdit(self.all_config.get("web_copy_width", "0"))
 
         save_button = self.addButton("Save all", self.save_all)
         cancel_button = self.addButton("Cancel", self.close)
@@ -555,8 +3508,18 @@ class ConfigWindow(QWidget):
         gbox.addWidget(self.filter_filepath_label, 4, 0)
         gbox.addWidget(filter_filepath_change_button, 4, 1)
         gbox.addWidget(filter_filepath_clear_button, 4, 2)
-        gbox.addWidget(save_button, 5, 1)
-        gbox.addWidget(cancel_button, 5, 2)
+        gbox.addWidget(self.live_filter_check, 4, 3)
+        gbox.addWidget(output_format_label, 5, 0)
+        gbox.addWidget(self.output_format_combo, 5, 1)
+        gbox.addWidget(self.output_progressive_check, 5, 2)
+        gbox.addWidget(output_quality_label, 6, 0)
+        gbox.addWidget(self.output_quality_entry, 6, 1)
+        gbox.addWidget(png_compress_level_label, 7, 0)
+        gbox.addWidget(self.png_compress_level_entry, 7, 1)
+        gbox.addWidget(web_copy_width_label, 8, 0)
+        gbox.addWidget(self.web_copy_width_entry, 8, 1)
+        gbox.addWidget(save_button, 9, 1)
+        gbox.addWidget(cancel_button, 9, 2)
 
     def change_dir_config(self):
         fname = QFileDialog.getOpenFileName(self, 'Select file', 
@@ -612,23 +3575,61 @@ class ConfigWindow(QWidget):
         self.filter_filepath_label.setText("Filter file path")
 
     def save_all(self):
+        for name, entry, valid in (
+            ("Quality", self.output_quality_entry, OUTPUT_QUALITIES),
+            ("PNG compress level", self.png_compress_level_entry, PNG_COMPRESS_LEVELS)
+        ):
+            if entry.text().isdigit() and int(entry.text()) not in valid:
+                QMessageBox.warning(self, 'Settings', f'{name} must be between {valid[0]} and {valid[-1]}')
+                return
+                # Window stays open to correct it, nothing is saved
+
         images_per_session = self.images_session_entry.text()
         if images_per_session != "":
             self.all_config["images_session"] = images_per_session
 
-        configActions = ConfigManager()
-        configActions.save(self.all_config)
+        self.all_config["output_format"] = self.output_format_combo.currentText()
+        self.all_config["output_progressive"] = "1" if self.output_progressive_check.isChecked() else "0"
+        self.all_config["live_filter"] = "1" if self.live_filter_check.isChecked() else "0"
+
+        for param, entry in (
+            ("output_quality", self.output_quality_entry),
+            ("png_compress_level", self.png_compress_level_entry),
+            ("web_copy_width", self.web_copy_width_entry)
+        ):
+            if entry.text().isdigit():
+                self.all_config[param] = entry.text()
+
+        edited = {
+            key: value for key, value in self.all_config.items()
+            if self.opened_config.get(key) != value
+        }
+
+        configActions = get_config()
+        configActions.update(edited)
+        # Keeps values changed elsewhere while window was open
 
         self.close()
 
 class ControlWindow(QWidget):
+    camerasProbed = QtCore.pyqtSignal()
+    # Queued from probing thread
+
     def __init__(self):
         QWidget.__init__(self)
         self.capture = None
         self.calibrateWindow = None
 
+        self.configWatcher = QtCore.QFileSystemWatcher([os.path.dirname(CONFIG_FILEPATH)])
+        self.configWatcher.directoryChanged.connect(self.configFileChanged)
+        # Directory is watched, config file is replaced on every save
+
         self.initUI()
 
+        self.camerasProbed.connect(self.camerasProbedSlot)
+        CAMERA_INVENTORY.subscribe(self.camerasProbedCallback)
+        self.setProbing(CAMERA_INVENTORY.isProbing())
+
         self.setWindowTitle('Control Panel')
         self.showFullScreen()
         self.showMaximized()
@@ -661,6 +3662,8 @@ class ControlWindow(QWidget):
         self.select_camera_button = self.addButton("Select Camera", self.select_camera)
         self.open_config_button = self.addButton("Open Config", self.open_config)
         self.open_explorer_button = self.addButton("Open Explorer", self.open_explorer)
+        self.multi_camera_button = self.addButton("Multi Camera", self.startMultiCapture)
+        self.refresh_cameras_button = self.addButton("Refresh Cameras", self.refresh_cameras)
         self.quit_button = self.addButton("End", self.endCapture)
 
         gbox = QGridLayout(self)
@@ -673,7 +3676,9 @@ class ControlWindow(QWidget):
         gbox.addWidget(self.select_camera_button, 2, 0)
         gbox.addWidget(self.open_config_button, 2, 1)
         gbox.addWidget(self.open_explorer_button, 3, 0)
-        gbox.addWidget(self.quit_button, 3, 1)
+        gbox.addWidget(self.multi_camera_button, 3, 1)
+        gbox.addWidget(self.refresh_cameras_button, 4, 0)
+        gbox.addWidget(self.quit_button, 4, 1)
 
     def calibrate(self):
         if not self.capture:
@@ -685,8 +3690,13 @@ class ControlWindow(QWidget):
         self.capture.start()
         self.capture.show()
 
+    def configFileChanged(self, _):
+        get_config().reload()
+        # Notifies open windows only if config file was modified
+
     def open_explorer(self):
-        os.system(f"start {MAIN_FOLDER}")
+        self.gallery = GalleryWindow()
+        self.gallery.show()
 
     def select_camera(self):
         if not self.capture:
@@ -712,6 +3722,42 @@ class ControlWindow(QWidget):
         self.capture.start()
         self.capture.show()
 
+    def refresh_cameras(self):
+        multiCapture = getattr(self, "multiCapture", None)
+        if self.capture or (multiCapture and multiCapture.isVisible()):
+            QMessageBox.warning(self, 'Refresh Cameras', 'Close capture windows before refreshing cameras')
+            return
+            # Cameras in use would not answer probing
+
+        self.setProbing(True)
+        CAMERA_INVENTORY.probe_async()
+
+    def setProbing(self, probing):
+        self.multi_camera_button.setEnabled(not probing)
+        self.refresh_cameras_button.setEnabled(not probing)
+        # Multi camera needs inventory, buttons come back when probing ends
+
+    def camerasProbedCallback(self):
+        self.camerasProbed.emit()
+
+    def camerasProbedSlot(self):
+        self.setProbing(False)
+
+    def startMultiCapture(self):
+        if CAMERA_INVENTORY.isProbing():
+            self.setProbing(True)
+            return
+
+        indexes = CAMERA_INVENTORY.indexes()[:MAX_CAMERAS]
+
+        if not indexes:
+            QMessageBox.warning(self, 'Multi Camera', 'No cameras were found')
+            return
+
+        self.multiCapture = MultiCaptureWindow(indexes, get_config().get_int("detection_workers", 2))
+        self.multiCapture.start()
+        self.multiCapture.show()
+
     def endCapture(self):
         if self.capture:
             self.capture.deleteLater()
@@ -743,12 +3789,34 @@ class ArgParsing():
         self.ap.add_argument("-c", "--config", required=False, help="Sets config file name and path")
         self.ap.add_argument("-m", "--main", required=False, help="Sets images folder path")
         self.ap.add_argument("-i", "--images", required=False, help="Sets number of images per session")
+        self.ap.add_argument("--format", required=False, choices=list(OUTPUT_FORMATS), help="Sets output format of strips")
+        self.ap.add_argument("--quality", required=False, type=int, help="Sets JPEG and WebP quality, 1 to 100")
+        self.ap.add_argument("--compress-level", required=False, type=int, choices=PNG_COMPRESS_LEVELS, help="Sets PNG compress level")
+        self.ap.add_argument("--progressive", required=False, action="store_true", default=None, help="Saves progressive JPEG")
+        self.ap.add_argument("--web-width", required=False, type=int, help="Saves a web copy of this width, 0 disables it")
+        self.ap.add_argument("--metrics", required=False, action="store_true", help="Shows debug overlay and exports stage timings")
+        self.ap.add_argument("--calibrate-dir", required=False, help="Calibrates without display from a folder of images")
+        self.ap.add_argument("--labels", required=False, help="Sets labels file of calibration folder, one 'filename,people' per line")
+        self.ap.add_argument("--rerender", required=False, nargs="?", const=SESSIONS_FOLDER, help="Renders again strips of saved sessions folder")
+        self.ap.add_argument("--output", required=False, default=f"{DIRECTORY}/rerender", help="Sets folder for rendered strips")
+        self.ap.add_argument("--workers", required=False, type=int, help="Sets number of processes for batch work")
+        self.ap.add_argument("--headless", action="store_true", help="Runs sessions without display, triggered from stdin")
+        self.ap.add_argument("--port", required=False, type=int, help="Also takes headless triggers on this local TCP port")
+        self.ap.add_argument("--source", required=False, help="Reads frames from a camera index, video file or images folder")
+        self.ap.add_argument("--free-run", action="store_true", help="Delivers replayed frames as fast as they are consumed")
 
     def get(self):
-        return vars(self.ap.parse_args())
+        args = vars(self.ap.parse_args())
+
+        if args["quality"] is not None and args["quality"] not in OUTPUT_QUALITIES:
+            self.ap.error("argument --quality: must be between 1 and 100")
+
+        return args
 
 def main():
-    global CONFIG_FILENAME, CONFIG_FILEPATH, MAIN_FOLDER, IMAGES_PER_SESSION
+    global CONFIG_FILENAME, CONFIG_FILEPATH, MAIN_FOLDER, FRAME_SOURCE, FREE_RUN
+
+    STARTUP.mark("imports")
 
     argparsing = ArgParsing()
     args = argparsing.get()
@@ -758,15 +3826,69 @@ def main():
         CONFIG_FILEPATH = f"{DIRECTORY}/{CONFIG_FILENAME}"
     if args["main"]:
         MAIN_FOLDER = args["main"]
-    if args["images"]:
-        IMAGES_PER_SESSION = args["images"]
+    if args["source"]:
+        FRAME_SOURCE = args["source"]
+        FREE_RUN = args["free_run"]
+        # Not saved on config, camera is used again on next start
 
-    configActions = ConfigManager()
+    configActions = get_config()
+    if args["images"]:
+        configActions.set("images_session", args["images"])
+    if args["format"]:
+        configActions.set("output_format", args["format"])
+    if args["quality"] is not None:
+        configActions.set("output_quality", str(args["quality"]))
+    if args["compress_level"] is not None:
+        configActions.set("png_compress_level", str(args["compress_level"]))
+    if args["progressive"]:
+        configActions.set("output_progressive", "1")
+    if args["web_width"] is not None:
+        configActions.set("web_copy_width", str(args["web_width"]))
     configActions.save()
     # Saves changes
 
+    if args["calibrate_dir"]:
+        calibrate_directory(args["calibrate_dir"], args["labels"], args["workers"])
+        return
+        # Headless, no window is needed
+
+    if args["rerender"]:
+        rerender_sessions(args["rerender"], args["output"], args["workers"])
+        return
+
+    if args["metrics"] or configActions.get_int("metrics_enabled"):
+        METRICS.enabled = True
+        METRICS.start_export(f"{DIRECTORY}/{METRICS_FILENAME}")
+        # Periodic JSON file, to be scraped by monitoring
+
+    replaying = FRAME_SOURCE is not None and not str(FRAME_SOURCE).isdigit()
+
+    if not CAMERA_INVENTORY.load():
+        if not replaying:
+            CAMERA_INVENTORY.probe_async()
+            # First run or devices changed, probed on background while control panel opens
+    elif not replaying:
+        camera_index = configActions.get_int("camera_index")
+        indexes = CAMERA_INVENTORY.indexes()
+
+        if indexes and camera_index not in indexes:
+            print(f"Camera {camera_index} not found, using camera {indexes[0]}")
+            configActions.set("camera_index", str(indexes[0]))
+            configActions.save()
+
+    if args["headless"]:
+        HeadlessKiosk(configured_source(), args["port"]).run()
+        return
+        # No QApplication, frames are never turned into QImage
+
+    WARMUP.start((configured_source(),), configActions.get_float("face_detection_coeff", 0.8))
+    # First session starts without loading model or opening camera
+
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(WARMUP.close)
     control_window = ControlWindow()
+    QtCore.QTimer.singleShot(0, lambda: STARTUP.mark("window shown"))
+    # Runs once event loop has shown control panel
 
     sys.exit(app.exec_())
 